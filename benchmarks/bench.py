@@ -0,0 +1,233 @@
+'''Times the stages of the formatter on the generated corpus.
+
+    python benchmarks/bench.py -o results.json
+    python benchmarks/bench.py --compare old.json new.json
+    python benchmarks/bench.py --handlers
+
+Every stage is timed separately on the output of the previous one. The
+results are written as JSON, with the commit they were measured on, so
+runs of different commits can be compared. With --handlers, the time of
+every handler of the Formatter is shown instead'''
+
+import sys
+import os
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reformat.reformat import Formatter, ScopeSetter, LineSplitter, \
+    RegexLineSplitter, StringReplacer, reformat
+from benchmarks.corpus import generators
+
+if hasattr(time, 'perf_counter'):
+    timer = time.perf_counter
+else:
+    timer = time.time
+
+stages = ['LineSplitter.parse', 'RegexLineSplitter.parse', 'ScopeSetter.parse',
+          'merge_equal_scopes', 'Formatter.format_line_part', 'reformat']
+
+def time_stages(text, set_indent=True, extra_newlines=True):
+    '''Returns a dict with the time of every stage on text'''
+    times = {}
+
+    start = timer()
+    LineSplitter(text).parse()
+    times['LineSplitter.parse'] = timer() - start
+
+    start = timer()
+    line_parts = RegexLineSplitter(text).parse()
+    times['RegexLineSplitter.parse'] = timer() - start
+
+    set_scopes = ScopeSetter(line_parts, None, extra_newlines)
+    start = timer()
+    set_scopes.parse()
+    times['ScopeSetter.parse'] = timer() - start
+
+    start = timer()
+    line_parts = set_scopes.merge_equal_scopes()
+    times['merge_equal_scopes'] = timer() - start
+
+    formatter = Formatter(text)
+    formatter.set_indent = set_indent
+    formatter.extra_newlines = extra_newlines
+    start = timer()
+    for line_part in line_parts:
+        formatter.format_line_part(line_part)
+    times['Formatter.format_line_part'] = timer() - start
+
+    start = timer()
+    reformat(text, set_indent=set_indent, extra_newlines=extra_newlines)
+    times['reformat'] = timer() - start
+
+    return times
+
+def time_handlers(text, extra_newlines=True):
+    '''Returns a dict with the time every handler takes on the normal line
+    parts of text that contain one of its triggers, without the cache of
+    the Formatter. Every line part is formatted on its own, so the
+    handlers can run one after the other over all line parts'''
+    set_scopes = ScopeSetter(RegexLineSplitter(text).parse(), None,
+                             extra_newlines)
+    set_scopes.parse()
+    line_parts = [line_part for line_part in set_scopes.merge_equal_scopes()
+                  if line_part.type == StringReplacer.Normal]
+
+    times = {}
+    for handler in Formatter.handlers:
+        trigger = Formatter.triggers.get(handler)
+        if trigger is not None:
+            trigger = frozenset(trigger)
+        start = timer()
+        for line_part in line_parts:
+            if trigger is None or not trigger.isdisjoint(line_part.text):
+                getattr(line_part, handler)()
+        times[handler] = timer() - start
+    return times
+
+def report_handlers(lines=2000, cases=None, out=sys.stdout):
+    '''Write the time of every handler, and its share of the time of
+    reformat, which formats repeated line parts only once'''
+    for name in sorted(cases or generators):
+        text = generators[name](lines)
+        start = timer()
+        reformat(text, set_indent=True, extra_newlines=True)
+        total = timer() - start
+        times = time_handlers(text)
+
+        out.write('%s: reformat %.4fs, handlers %.4fs without the cache\n' %
+                  (name, total, sum(times.values())))
+        for handler in sorted(times, key=lambda handler: -times[handler]):
+            out.write('    %-40s %9.4fs %6.1f%%\n' %
+                      (handler, times[handler],
+                       100 * times[handler] / total))
+
+def measure_memory(text, extra_newlines=True):
+    '''Returns the number of line parts and the peak memory in bytes of
+    splitting text and setting the scopes, while all line parts are alive'''
+    if tracemalloc is None:
+        return None
+
+    tracemalloc.start()
+    try:
+        line_parts = RegexLineSplitter(text).parse()
+        set_scopes = ScopeSetter(line_parts, None, extra_newlines)
+        new_line_parts = set_scopes.parse()
+        count = len(line_parts) + len(new_line_parts)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'line_parts': count, 'peak': peak}
+
+def commit():
+    path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=path, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+def run(lines=2000, repeat=5, cases=None, out=None, memory=False):
+    '''Time every stage on every case repeat times, and optionally
+    measure the memory. Returns a dict that can be stored as JSON'''
+    results = {}
+    for name in sorted(cases or generators):
+        text = generators[name](lines)
+        runs = [time_stages(text) for i in range(repeat)]
+        results[name] = {'lines': len(text.splitlines()),
+                         'bytes': len(text)}
+        for stage in stages:
+            times = sorted(r[stage] for r in runs)
+            results[name][stage] = {'min': times[0],
+                                    'median': times[len(times) // 2]}
+        if memory:
+            results[name]['memory'] = measure_memory(text)
+
+        if out is not None:
+            out.write('%-20s %8.3fs' % (name, results[name]['reformat']['min']))
+            if results[name].get('memory'):
+                out.write(' %8d line parts %10d bytes' %
+                          (results[name]['memory']['line_parts'],
+                           results[name]['memory']['peak']))
+            out.write('\n')
+
+    return {'commit': commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'lines': lines,
+            'repeat': repeat,
+            'results': results}
+
+def compare(old, new, out):
+    '''Write the ratio of the new and old minimum times of every stage'''
+    out.write('%s -> %s\n' % (old.get('commit'), new.get('commit')))
+    out.write('%-20s %-28s %10s %10s %7s\n' %
+              ('case', 'stage', 'old', 'new', 'ratio'))
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        for stage in stages:
+            if stage not in old['results'][name] or \
+               stage not in new['results'][name]:
+                continue
+            a = old['results'][name][stage]['min']
+            b = new['results'][name][stage]['min']
+            out.write('%-20s %-28s %9.4fs %9.4fs %6.2fx\n' %
+                      (name, stage, a, b, b / a if a else 0))
+
+        if old['results'][name].get('memory') and \
+           new['results'][name].get('memory'):
+            a = old['results'][name]['memory']['peak']
+            b = new['results'][name]['memory']['peak']
+            out.write('%-20s %-28s %9.1fM %9.1fM %6.2fx\n' %
+                      (name, 'memory', a / 1e6, b / 1e6, float(b) / a))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the formatter')
+    parser.add_argument('-n', '--lines', type=int, default=2000,
+                        help='number of lines of every case')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-c', '--case', action='append', dest='cases',
+                        choices=sorted(generators))
+    parser.add_argument('-m', '--memory', action='store_true',
+                        help='also measure the peak memory of the line parts')
+    parser.add_argument('-o', '--output', help='write the results to a file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files')
+    parser.add_argument('--handlers', action='store_true',
+                        help='show the time of every handler')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        results = []
+        for fname in args.compare:
+            f = open(fname)
+            results.append(json.load(f))
+            f.close()
+        compare(results[0], results[1], sys.stdout)
+        return
+
+    if args.handlers:
+        report_handlers(args.lines, args.cases, sys.stdout)
+        return
+
+    results = run(args.lines, args.repeat, args.cases, sys.stdout,
+                  args.memory)
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''Generators for C++ inputs to benchmark the formatter with. Every
+generator is deterministic and returns roughly the requested number of
+lines'''
+
+import random
+
+def names(rnd, n):
+    return ['%s%d' % (rnd.choice(['a', 'foo', 'bar', 'value', 'idx']), i)
+            for i in range(n)]
+
+def realistic(lines=2000, seed=0):
+    '''Classes with members, functions with loops, conditions, pointers
+    and references'''
+    rnd = random.Random(seed)
+    out = ['#include <vector>\n', '#include <iostream>\n', '\n']
+    i = 0
+    while len(out) < lines:
+        a, b, c = names(rnd, 3)
+        out += [
+            'template<typename T>\n',
+            'class Container%d : public Base<T>\n' % i,
+            '{\n',
+            'public:\n',
+            'Container%d(int %s, T &%s): %s_(%s), %s_(&%s) {}\n' %
+            (i, a, b, a, a, b, b),
+            'int get(const std::vector<T> &v, int *p) const\n',
+            '{\n',
+            'for (int i=0; i<v.size(); ++i)\n',
+            '{\n',
+            'if (v[i]>%s_ && *p!=-1) %s+=v[i]*2;\n' % (a, c),
+            'else if(%s_->empty()||!%s) return -1;\n' % (b, c),
+            '}\n',
+            'return %s_<0 ? -%s : %s%%3;\n' % (a, c, c),
+            '}\n',
+            'private:\n',
+            'int %s_;\n' % a,
+            'T *%s_;\n' % b,
+            '};\n',
+            '\n']
+        i += 1
+    return ''.join(out[:lines])
+
+def deep_namespaces(lines=2000, depth=40, seed=0):
+    '''Deeply nested namespaces and scopes'''
+    rnd = random.Random(seed)
+    out = []
+    while len(out) < lines:
+        for i in range(depth):
+            out.append('namespace ns%d {\n' % i)
+        for name in names(rnd, 5):
+            out.append('int %s=%d;\n' % (name, rnd.randint(0, 100)))
+        for i in range(depth):
+            out.append('}\n')
+    return ''.join(out[:lines])
+
+def template_chains(lines=2000, length=12, seed=0):
+    '''Long chains of nested templates'''
+    rnd = random.Random(seed)
+    types = ['int', 'double', 'std::string', 'Foo']
+    out = []
+    while len(out) < lines:
+        text = rnd.choice(types)
+        for i in range(rnd.randint(1, length)):
+            kind = rnd.choice(['std::vector<%s>', 'std::pair<int,%s>',
+                               'std::map<%s,%s>', 'std::shared_ptr<%s>'])
+            text = kind.replace('%s', text, 1).replace('%s',
+                                                        rnd.choice(types))
+        out.append('typedef %s type%d;\n' % (text, len(out)))
+        out.append('%s value%d=make<%s>(a<b, c>d);\n' %
+                   (text, len(out), text))
+    return ''.join(out[:lines])
+
+def initializer_lists(lines=2000, width=12, seed=0):
+    '''A giant initializer list and nested initializer lists'''
+    rnd = random.Random(seed)
+    out = ['int values[] = {\n']
+    while len(out) < lines // 2:
+        out.append(','.join(str(rnd.randint(-1000, 1000))
+                            for i in range(width)) + ',\n')
+    out.append('0};\n')
+    out.append('std::vector<std::vector<int> > nested = {\n')
+    while len(out) < lines - 1:
+        out.append('{' + ', '.join(str(rnd.randint(0, 9))
+                                   for i in range(width)) + '},\n')
+    out.append('{}};\n')
+    return ''.join(out)
+
+def stream_chains(lines=2000, length=20, seed=0):
+    '''Long << chains over one or multiple lines'''
+    rnd = random.Random(seed)
+    out = []
+    while len(out) < lines:
+        items = [rnd.choice(['a', '"text"', 'std::setw(3)', 'x*y',
+                             '"a \\"quoted\\" string"', 'f(a,b)'])
+                 for i in range(rnd.randint(2, length))]
+        if rnd.random() < 0.5:
+            out.append('std::cout<<' + '<<'.join(items) + '<<std::endl;\n')
+        else:
+            out.append('std::cout << ' + items[0] + ' <<\n')
+            for item in items[1:]:
+                out.append('    ' + item + ' <<\n')
+            out.append('    std::endl;\n')
+    return ''.join(out[:lines])
+
+def comment_heavy(lines=2000, seed=0):
+    '''Line comments, multiline comments and comments after code'''
+    rnd = random.Random(seed)
+    out = []
+    while len(out) < lines:
+        choice = rnd.randint(0, 3)
+        if choice == 0:
+            out.append('// a=b+c; comment with code "and a string"\n')
+        elif choice == 1:
+            out.append('/**\n')
+            for i in range(rnd.randint(1, 8)):
+                out.append(' * Documentation of a<b and c*d, see "x"\n')
+            out.append(' */\n')
+        elif choice == 2:
+            out.append('int a=b; /* inline */ int c=d; // trailing\n')
+        else:
+            out.append('f(a, /* b */ c);\n')
+    return ''.join(out[:lines])
+
+generators = {
+    'realistic': realistic,
+    'deep_namespaces': deep_namespaces,
+    'template_chains': template_chains,
+    'initializer_lists': initializer_lists,
+    'stream_chains': stream_chains,
+    'comment_heavy': comment_heavy,
+}
+
+def corpus(lines=2000):
+    '''Dict with the text of every generator'''
+    return dict((name, generator(lines))
+                for name, generator in generators.items())
@@ -1,32 +1,72 @@
+import weakref
+
 class Scope(object):
-    def __init__(self, parent, item = None):
-        self.parent = None
-        self.item = None
+    '''Immutable scope. Scopes are interned, so creating a scope with the
+    same parent and item twice gives the same object, and equal scopes
+    are always identical'''
 
-        self._indentation = 0
-        self.position = 0
-        self.alignment = {}
-        self.continuation = False
+    __slots__ = ('parent', 'item', '_length', '_counts', '__weakref__')
 
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, parent=None, item=None):
         if not item:
+            if isinstance(parent, Scope):
+                return parent
+            if not parent:
+                return cls.root
+
+            depth = 0
             if isinstance(parent, int):
-                if parent > 0:
-                    self.parent = Scope(parent - 1)
-                    self.item = '{'
-            elif isinstance(parent, Scope):
-                self.parent = parent.parent
-                self.item = parent.item
+                depth = parent
+
+            scope = cls.intern(None, None)
+            for i in range(depth):
+                scope = cls.intern(scope, '{')
+            return scope
+
+        return cls.intern(parent, item)
+
+    @classmethod
+    def intern(cls, parent, item):
+        key = (parent, item)
+        scope = cls._interned.get(key)
+        if scope is not None:
+            return scope
+
+        scope = object.__new__(cls)
+        init = object.__setattr__
+        init(scope, 'parent', parent)
+        init(scope, 'item', item)
+
+        # The length and a dict with the number of times every item occurs
+        # in the scope, so we don't have to walk over the parents
+        if parent is None:
+            init(scope, '_length', 0)
+            init(scope, '_counts', {})
         else:
-            self.parent = parent
-            self.item = item
+            counts = parent._counts.copy()
+            counts[item] = counts.get(item, 0) + 1
+            init(scope, '_length', parent._length + 1)
+            init(scope, '_counts', counts)
+
+        cls._interned[key] = scope
+        return scope
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Scope is immutable')
+
+    def __reduce__(self):
+        return (Scope, (self.parent, self.item))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __len__(self):
-        scope = self
-        length = 0
-        while scope.parent is not None:
-            scope = scope.parent
-            length += 1
-        return length
+        return self._length
 
     def __getitem__(self, index):
         scope = self
@@ -40,16 +80,6 @@ class Scope(object):
 
         return item
 
-    def __setitem__(self, index, item):
-        scope = self
-
-        if index < 0:
-            for i in range(-index-1):
-                scope = scope.parent
-        else:
-            raise IndexError('Not implemented')
-        scope.item = item
-
     def __iter__(self):
         scope = self
         while scope.parent is not None:
@@ -57,57 +87,50 @@ class Scope(object):
             scope = scope.parent
             yield item
 
-    def __eq__(self, other):
-        if not isinstance(other, Scope):
-            return False
-        return self.__dict__ == other.__dict__
-
     def __repr__(self):
         return repr([self.parent, self.item])
 
     def __contains__(self, item):
-        for i in self:
+        for i in self._counts:
             if item in i:
                 return True
         return False
 
-    def remove(self, item):
-        def helper(scope):
-            '''Recursively iterates over nested lists to find the
-            deepest match. Returns after if nothing was found'''
-            while scope.parent is not None:
-                if item in scope.item:
-                    if helper(scope.parent):
-                        return True
-
-                    if scope.parent.parent is not None:
-                        scope.item = scope.parent.item
-                        scope.parent = scope.parent.parent
-                    else:
-                        scope.item = None
-                        scope.parent = None
-                    return True
-                scope = scope.parent
-            return False
+    def count(self, item):
+        '''Number of times item occurs in the scope'''
+        return self._counts.get(item, 0)
 
+    def remove(self, item):
+        '''Returns the scope without the outermost item that contains
+        item'''
+        scopes = []
+        match = None
         scope = self
-        error = ValueError('Item \'%s\' not found in scope \'%s\'' % (item, self))
-        if not len(scope):
-            raise error
+        while scope.parent is not None:
+            scopes.append(scope)
+            if item in scope.item:
+                match = len(scopes)
+            scope = scope.parent
 
-        if not helper(scope):
-            raise error
+        if match is None:
+            raise ValueError('Item \'%s\' not found in scope \'%s\'' % (item, self))
+
+        scope = scopes[match - 1].parent
+        if scope.parent is None:
+            scope = Scope(None)
+        for s in reversed(scopes[:match - 1]):
+            scope = Scope.intern(scope, s.item)
+        return scope
 
     def indented_scopes(self):
         scopes = 0
-        for s in self:
-            if s in ['{', 'flow', 'initializer list']:
-                scopes += 1
-        return scopes + self.indentation
+        for s in ['{', 'flow', 'initializer list']:
+            scopes += self._counts.get(s, 0)
+        return scopes
 
     def is_global(self):
-        for s in self:
-            if s in ['{', 'initializer list']:
+        for s in ['{', 'initializer list']:
+            if self._counts.get(s, 0):
                 return False
         return True
 
@@ -117,10 +140,121 @@ class Scope(object):
 
         return self.item
 
-    def set_last(self, item):
+    last = property(get_last)
+
+# The global scope is kept alive, because most line parts start in it
+Scope.root = Scope.intern(None, None)
+
+class ScopeState(object):
+    '''State of one occurrence of a scope in a file. While parsing, the
+    parent and item may still change in place when a bracket turns out not
+    to be a bracket, which changes the scope of all line parts that were
+    already added in it. While formatting it stores the alignment and
+    indentation of the line parts in the scope'''
+
+    # Incremented when a state is changed in place, which invalidates
+    # the cached scopes of all states
+    generation = 0
+
+    def __init__(self, parent=None, item=None):
+        self.parent = parent
         self.item = item
 
-    last = property(get_last, set_last)
+        self._scope = None
+        self._generation = 0
+
+        self._indentation = 0
+        self.position = 0
+        self.alignment = {}
+        self.continuation = False
+
+    @classmethod
+    def from_scope(cls, scope):
+        '''Create states for a Scope and all of its parents'''
+        scope = Scope(scope)
+        state = cls(None, scope.item if scope.parent is None else None)
+        for item in reversed(list(scope)):
+            state = cls(state, item)
+        return state
+
+    def get_scope(self):
+        '''The Scope for the current parents and item'''
+        generation = ScopeState.generation
+        if self._scope is not None and self._generation == generation:
+            return self._scope
+
+        # Find the first parent that is still valid, and build the scopes
+        # from there so we don't recurse over deep scopes
+        states = []
+        state = self
+        while state is not None and (state._scope is None or
+                                     state._generation != generation):
+            states.append(state)
+            state = state.parent
+
+        scope = None
+        if state is not None:
+            scope = state._scope
+
+        for state in reversed(states):
+            scope = Scope.intern(scope, state.item)
+            state._scope = scope
+            state._generation = generation
+
+        return self._scope
+
+    scope = property(get_scope)
+
+    def __deepcopy__(self, memo):
+        '''Copy the state and its parents iteratively, because they may be
+        nested deeper than the recursion limit'''
+        states = []
+        state = self
+        while state is not None and id(state) not in memo:
+            states.append(state)
+            state = state.parent
+
+        parent = None
+        if state is not None:
+            parent = memo[id(state)]
+
+        for state in reversed(states):
+            new_state = object.__new__(ScopeState)
+            new_state.__dict__.update(state.__dict__)
+            new_state.parent = parent
+            new_state.alignment = state.alignment.copy()
+            memo[id(state)] = new_state
+            parent = new_state
+
+        return memo[id(self)]
+
+    def remove(self, item):
+        '''Remove the outermost state that contains item in place'''
+        def helper(state):
+            '''Recursively iterates over nested lists to find the
+            deepest match. Returns after if nothing was found'''
+            while state.parent is not None:
+                if item in state.item:
+                    if helper(state.parent):
+                        return True
+
+                    if state.parent.parent is not None:
+                        state.item = state.parent.item
+                        state.parent = state.parent.parent
+                    else:
+                        state.item = None
+                        state.parent = None
+                    return True
+                state = state.parent
+            return False
+
+        if self.parent is None or not helper(self):
+            raise ValueError('Item \'%s\' not found in scope \'%s\'' % (item, self.scope))
+
+        ScopeState.generation += 1
+
+    def indented_scopes(self):
+        return self.scope.indented_scopes() + self.indentation
 
     def get_indentation(self):
         return self._indentation + self.continuation
@@ -1,2 +1,5 @@
-from .reformat import reformat
+from .reformat import reformat, reformat_iter, first_difference, \
+    LimitExceeded, Cancelled
+from .incremental import IncrementalFormatter
+from .parallel import reformat_parallel
 from .Scope import Scope
@@ -0,0 +1,3 @@
+from .reformat import main
+
+main()
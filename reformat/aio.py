@@ -0,0 +1,66 @@
+'''asyncio interface of the formatter. This module needs Python 3.7'''
+
+import asyncio
+import functools
+import threading
+import concurrent.futures
+
+from .reformat import reformat, RegexLineSplitter
+
+class AsyncFormatter(object):
+    '''Formats texts on an asyncio event loop without blocking it. The
+    formatting runs in executor, or in the default executor of the loop.
+    A request for a named buffer cancels the request for the same buffer
+    that is still running, which then raises CancelledError. Formatting
+    in a thread stops as well, even in the middle of a long line, but in
+    a process pool it runs to the end and its result is dropped'''
+
+    def __init__(self, executor=None):
+        self.executor = executor
+
+        # The running task of every buffer
+        self.tasks = {}
+
+    async def format(self, text, buffer=None, base_scope=None,
+                     set_indent=False, extra_newlines=False,
+                     splitter=RegexLineSplitter):
+        '''Format text like reformat() and return the result'''
+        task = asyncio.ensure_future(self.run(
+            text, base_scope, set_indent, extra_newlines, splitter))
+        if buffer is None:
+            return await task
+
+        previous = self.tasks.get(buffer)
+        if previous is not None:
+            previous.cancel()
+        self.tasks[buffer] = task
+        try:
+            return await task
+        finally:
+            if self.tasks.get(buffer) is task:
+                del self.tasks[buffer]
+
+    async def run(self, *args):
+        loop = asyncio.get_running_loop()
+        if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+            return await loop.run_in_executor(
+                self.executor, functools.partial(reformat, *args))
+
+        cancelled = threading.Event()
+        try:
+            return await loop.run_in_executor(
+                self.executor,
+                functools.partial(reformat, *args, cancelled=cancelled))
+        except asyncio.CancelledError:
+            # The formatter raises Cancelled in its thread, which nobody
+            # waits for anymore
+            cancelled.set()
+            raise
+
+async def reformat_async(text, base_scope=None, set_indent=False,
+                         extra_newlines=False, splitter=RegexLineSplitter,
+                         executor=None):
+    '''Same as reformat, but formats in executor, or in the default
+    executor of the loop, so other tasks keep running'''
+    return await AsyncFormatter(executor).format(
+        text, None, base_scope, set_indent, extra_newlines, splitter)
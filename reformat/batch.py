@@ -0,0 +1,288 @@
+import sys
+import os
+import shutil
+import fnmatch
+import argparse
+import functools
+import multiprocessing
+
+from .reformat import reformat, first_difference, LimitExceeded
+from .parallel import reformat_parallel, default_min_lines
+from .cache import Cache, CANONICAL
+
+extensions = ['.c', '.cc', '.cpp', '.cxx', '.h', '.hh', '.hpp', '.hxx']
+ignore = ['.*', '*.bak']
+
+def is_ignored(name, ignore):
+    for pattern in ignore:
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+def find_files(paths, extensions=extensions, ignore=ignore):
+    '''Find the files in paths, which may be files or directories. Files
+    that are given explicitly are always included. Returns a list of
+    filenames, largest first, so the slowest files are started first
+    when they are formatted in parallel'''
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not is_ignored(d, ignore))
+            for name in sorted(names):
+                if is_ignored(name, ignore):
+                    continue
+                if os.path.splitext(name)[1] in extensions:
+                    files.append(os.path.join(root, name))
+
+    sizes = {}
+    for fname in files:
+        try:
+            sizes[fname] = os.path.getsize(fname)
+        except OSError:
+            sizes[fname] = 0
+
+    return sorted(files, key=lambda fname: -sizes[fname])
+
+def count_lines(fname):
+    try:
+        f = open(fname, 'rb')
+        count = sum(1 for line in f)
+        f.close()
+    except (IOError, OSError):
+        return 0
+    return count
+
+def format_file(fname, backup=True, cache=None, pool=None, jobs=None,
+                limits=None):
+    '''Format a file in place. Files that the cache knows to be formatted
+    already are skipped. With a pool, the file is split into chunks that
+    are formatted by jobs processes of the pool. limits is a dict with
+    the limits of reformat(). Returns a tuple with the filename and its
+    status, which is either 'formatted', 'unchanged', 'skipped' with the
+    limit that was exceeded, or an error'''
+    try:
+        f = open(fname, 'r')
+        lines = f.readlines()
+        f.close()
+
+        key = None
+        if cache is not None:
+            key = cache.key(''.join(lines), set_indent=True,
+                            extra_newlines=True)
+            if cache.get(key) == CANONICAL:
+                return fname, 'unchanged'
+
+        if pool is None:
+            format_text = functools.partial(
+                reformat, set_indent=True, extra_newlines=True,
+                **(limits or {}))
+        else:
+            format_text = functools.partial(
+                reformat_parallel, set_indent=True, extra_newlines=True,
+                jobs=jobs, pool=pool, min_lines=0)
+        text = format_text(lines)
+        if text == ''.join(lines):
+            if key is not None:
+                cache.put(key, CANONICAL)
+            return fname, 'unchanged'
+
+        # The next run finds the formatted text in the cache, but only if
+        # formatting it again does not change it
+        if key is not None and format_text(text) == text:
+            cache.put(cache.key(text, set_indent=True, extra_newlines=True),
+                      CANONICAL)
+
+        if backup and not os.path.exists(fname + '.bak'):
+            shutil.copyfile(fname, fname + '.bak')
+
+        f = open(fname, 'w')
+        f.write(text)
+        f.close()
+    except LimitExceeded as e:
+        return fname, 'skipped: %s' % e.reason
+    except Exception as e:
+        return fname, 'error: %s' % e
+
+    return fname, 'formatted'
+
+def check_file(fname, cache=None, limits=None):
+    '''Check if a file is formatted without writing anything. Returns a
+    tuple with the filename and its status, which is either 'formatted',
+    'not formatted', with the number of the first line that is not
+    formatted added to the filename, 'skipped' with the limit that was
+    exceeded, or an error'''
+    try:
+        f = open(fname, 'r')
+        lines = f.readlines()
+        f.close()
+
+        key = None
+        if cache is not None:
+            key = cache.key(''.join(lines), set_indent=True,
+                            extra_newlines=True)
+            if cache.get(key) == CANONICAL:
+                return fname, 'formatted'
+
+        line = first_difference(lines, set_indent=True, extra_newlines=True,
+                                **(limits or {}))
+        if line:
+            return '%s:%d' % (fname, line), 'not formatted'
+
+        if key is not None:
+            cache.put(key, CANONICAL)
+    except LimitExceeded as e:
+        return fname, 'skipped: %s' % e.reason
+    except Exception as e:
+        return fname, 'error: %s' % e
+
+    return fname, 'formatted'
+
+def run(paths, jobs=None, extensions=extensions, ignore=ignore, backup=True,
+        out=None, cache=None, check=False, split=default_min_lines,
+        limits=None):
+    '''Format all files in paths using a pool of jobs processes. Files
+    with at least split lines are formatted first, one by one, split into
+    chunks that are formatted by the whole pool. With check, the files
+    are only checked. Files that exceed one of limits, a dict with the
+    limits of reformat(), are left as they are. The status of every file
+    is written to out when it is done. Returns the number of files that
+    could not be formatted or are not formatted'''
+    if out is None:
+        out = sys.stdout
+
+    files = find_files(paths, extensions, ignore)
+
+    if check:
+        worker = functools.partial(check_file, cache=cache, limits=limits)
+    else:
+        worker = functools.partial(format_file, backup=backup, cache=cache,
+                                   limits=limits)
+
+    # The files are sorted by size, so the large ones come first. The
+    # limits are for whole files, so those are not split
+    large = []
+    if jobs != 1 and split and not check and not limits:
+        for fname in files:
+            if count_lines(fname) < split:
+                break
+            large.append(fname)
+
+    pool = None
+    if jobs != 1 and (len(files) > 1 or large):
+        pool = multiprocessing.Pool(jobs)
+
+        def iter_results():
+            for fname in large:
+                yield format_file(fname, backup, cache, pool, jobs)
+            for result in pool.imap_unordered(worker, files[len(large):]):
+                yield result
+        results = iter_results()
+    else:
+        results = (worker(fname) for fname in files)
+
+    errors = 0
+    try:
+        for fname, status in results:
+            if status.startswith('error') or status == 'not formatted':
+                errors += 1
+            out.write('%s: %s\n' % (fname, status))
+            out.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if cache is not None:
+        cache.evict()
+
+    return errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='reformat',
+        description='Format C++ files and directories in place')
+    parser.add_argument('paths', nargs='*', metavar='path',
+                        help='files or directories to format')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of processes (default: number of cores)')
+    parser.add_argument('-e', '--extension', action='append', dest='extensions',
+                        metavar='EXT',
+                        help='extension of the files to format in directories '
+                        '(default: %s)' % ' '.join(extensions))
+    parser.add_argument('-i', '--ignore', action='append', default=[],
+                        metavar='PATTERN',
+                        help='skip files and directories matching PATTERN')
+    parser.add_argument('--no-backup', action='store_false', dest='backup',
+                        help='do not write .bak files')
+    parser.add_argument('--cache', nargs='?', const='', default=None,
+                        metavar='DIR',
+                        help='skip files that were formatted before, using a '
+                        'cache in DIR (default: $REFORMAT_CACHE_DIR or '
+                        '~/.cache/reformat)')
+    parser.add_argument('--check', action='store_true',
+                        help='only check if the files are formatted, and '
+                        'report the first line that is not')
+    parser.add_argument('--split', type=int, default=default_min_lines,
+                        metavar='LINES',
+                        help='split files of at least LINES lines into chunks '
+                        'that are formatted in parallel (default: %d, 0 to '
+                        'disable)' % default_min_lines)
+    parser.add_argument('--timeout', type=float, default=None,
+                        metavar='SECONDS',
+                        help='leave files that take longer to format as they '
+                        'are')
+    parser.add_argument('--max-line-length', type=int, default=None,
+                        metavar='CHARS',
+                        help='leave files with longer lines as they are')
+    parser.add_argument('--max-depth', type=int, default=None,
+                        metavar='SCOPES',
+                        help='leave files with scopes nested deeper as they '
+                        'are')
+    parser.add_argument('--changed', action='store_true',
+                        help='only format the files in the paths that changed '
+                        'in git')
+    parser.add_argument('--since', default='HEAD', metavar='REVISION',
+                        help='the revision that --changed compares with '
+                        '(default: HEAD)')
+    parser.add_argument('--staged', action='store_true',
+                        help='format the changed files in the git index '
+                        'instead of the working tree, for pre-commit hooks')
+    parser.add_argument('--changed-lines', action='store_true',
+                        help='only format the statements with changed lines')
+    args = parser.parse_args(argv)
+
+    exts = extensions
+    if args.extensions:
+        exts = [e if e.startswith('.') else '.' + e for e in args.extensions]
+
+    limits = {}
+    for name in ['timeout', 'max_line_length', 'max_depth']:
+        if getattr(args, name) is not None:
+            limits[name] = getattr(args, name)
+
+    if args.changed or args.staged or args.changed_lines:
+        from .gitdiff import run as run_changed
+        try:
+            errors = run_changed(args.paths, args.since, args.staged,
+                                 args.changed_lines, args.check, args.backup,
+                                 exts, limits=limits)
+        except (OSError, RuntimeError) as e:
+            sys.stderr.write('reformat: %s\n' % e)
+            return 2
+        return 1 if errors else 0
+
+    if not args.paths:
+        parser.error('no paths to format')
+
+    cache = None
+    if args.cache is not None:
+        cache = Cache(args.cache or None)
+
+    errors = run(args.paths, args.jobs, exts, ignore + args.ignore,
+                 args.backup, cache=cache, check=args.check,
+                 split=args.split, limits=limits)
+    return 1 if errors else 0
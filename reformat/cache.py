@@ -0,0 +1,143 @@
+import os
+import hashlib
+import tempfile
+
+CANONICAL = 'canonical'
+
+def formatter_version():
+    '''Hash of the source of the formatter, so the cache is invalidated
+    whenever the formatter changes'''
+    h = hashlib.sha1()
+    path = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.py'):
+            f = open(os.path.join(path, name), 'rb')
+            h.update(f.read())
+            f.close()
+    return h.hexdigest()
+
+def default_path():
+    path = os.environ.get('REFORMAT_CACHE_DIR')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.cache', 'reformat')
+
+def digest(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+class Cache(object):
+    '''On disk cache of the hashes of inputs and options that are already
+    formatted, for which the value is CANONICAL. Every entry is a
+    separate file that is written atomically, so the cache can be used
+    from several processes at the same time'''
+
+    # The formatter version is computed once per process. Every cache
+    # also stores it, so it is pickled for pool workers that are spawned
+    version = None
+
+    def __init__(self, path=None, max_entries=100000):
+        if path is None:
+            path = default_path()
+        self.path = path
+        self.max_entries = max_entries
+
+        if Cache.version is None:
+            Cache.version = formatter_version()
+        self.version = Cache.version
+
+    def key(self, text, set_indent=False, extra_newlines=False,
+            base_scope=None):
+        options = repr((set_indent, extra_newlines, repr(base_scope)))
+        return digest(self.version + options + digest(text))
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        '''Returns the stored value, or None if there is none'''
+        fname = self.filename(key)
+        try:
+            f = open(fname, 'r')
+            value = f.read()
+            f.close()
+        except (IOError, OSError):
+            return None
+
+        if not value:
+            return None
+
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+
+        return value
+
+    def put(self, key, value):
+        fname = self.filename(key)
+        path = os.path.dirname(fname)
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        except OSError:
+            # Another process may have created it
+            if not os.path.isdir(path):
+                return
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=path, prefix='.tmp')
+        except OSError:
+            return
+
+        try:
+            f = os.fdopen(fd, 'w')
+            f.write(value)
+            f.close()
+            if hasattr(os, 'replace'):
+                os.replace(tmp, fname)
+            else:
+                os.rename(tmp, fname)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def entries(self):
+        '''List of (mtime, filename) tuples of all entries'''
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+
+        for d in os.listdir(self.path):
+            path = os.path.join(self.path, d)
+            if not os.path.isdir(path):
+                continue
+            for name in os.listdir(path):
+                fname = os.path.join(path, name)
+                try:
+                    entries.append((os.path.getmtime(fname), fname))
+                except OSError:
+                    pass
+        return entries
+
+    def evict(self):
+        '''Remove the least recently used entries until there are at most
+        max_entries left. Returns the number of removed entries'''
+        entries = self.entries()
+        if len(entries) <= self.max_entries:
+            return 0
+
+        entries.sort()
+        removed = 0
+        for mtime, fname in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(fname)
+                removed += 1
+            except OSError:
+                # Removed by another process
+                pass
+        return removed
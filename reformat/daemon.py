@@ -0,0 +1,242 @@
+import sys
+import os
+import json
+import socket
+import argparse
+import tempfile
+import collections
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from .reformat import reformat
+from .incremental import IncrementalFormatter
+
+# The options of reformat() and their defaults
+options = {'base_scope': None, 'set_indent': False, 'extra_newlines': False,
+           'timeout': None, 'max_line_length': None, 'max_depth': None}
+
+def default_path():
+    '''The socket is in a directory of the user, because another user who
+    creates it first would get the texts and could send back anything'''
+    path = os.environ.get('XDG_RUNTIME_DIR')
+    if not path:
+        path = tempfile.gettempdir()
+        if hasattr(os, 'getuid'):
+            path = os.path.join(path, 'reformat-%d' % os.getuid())
+    return os.path.join(path, 'reformat.sock')
+
+def check_owner(path):
+    '''Raise IOError if path belongs to another user'''
+    if hasattr(os, 'getuid') and os.stat(path).st_uid != os.getuid():
+        raise IOError('%s belongs to another user' % path)
+
+def make_private_dir(path):
+    '''Create a directory that only the user can access, or check that an
+    existing one is like that'''
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    check_owner(path)
+    if hasattr(os, 'getuid') and os.stat(path).st_mode & 0o077:
+        raise IOError('%s can be accessed by other users' % path)
+
+class Daemon(object):
+    '''Handles format requests. Every request is a JSON object on a single
+    line with the text and the options of reformat(). Requests for a
+    range of lines of a named buffer, with start and end, are formatted
+    incrementally. Every response is a JSON object on a single line with
+    the formatted text, or the error. A request with close for a buffer
+    removes its state'''
+
+    # Number of buffers of which the state is kept. The least recently
+    # used buffer is removed first
+    max_buffers = 32
+
+    def __init__(self):
+        self.buffers = collections.OrderedDict()
+
+    def handle(self, request):
+        buffer = request.get('buffer')
+        if request.get('close'):
+            self.buffers.pop(buffer, None)
+            return {}
+
+        text = request.get('text')
+        if text is None:
+            text = request.get('lines')
+        if text is None:
+            raise ValueError('No text in request')
+        if not isinstance(text, (str, list)):
+            text = text.encode('utf-8')
+
+        kwargs = dict((k, request[k]) for k in options if k in request)
+
+        if buffer is None or 'start' not in request:
+            return {'text': reformat(text, **kwargs)}
+
+        formatter = self.buffers.pop(buffer, None)
+        if formatter is None:
+            formatter = IncrementalFormatter(text)
+        else:
+            formatter.update(text)
+        self.buffers[buffer] = formatter
+        while len(self.buffers) > self.max_buffers:
+            self.buffers.popitem(last=False)
+
+        for k, default in options.items():
+            setattr(formatter, k, kwargs.get(k, default))
+
+        start = request['start']
+        end = request.get('end', start + 1)
+        first, last, text = formatter.format_range(start, end)
+        return {'text': text, 'start': first, 'end': last}
+
+    def handle_line(self, line):
+        '''Handle a request line and return the response line'''
+        try:
+            response = self.handle(json.loads(line))
+        except Exception as e:
+            response = {'error': '%s: %s' % (type(e).__name__, e)}
+        return json.dumps(response) + '\n'
+
+    def serve(self, rfile, wfile):
+        '''Handle requests from rfile until it is closed'''
+        while True:
+            line = rfile.readline()
+            if not line:
+                break
+            binary = not isinstance(line, str)
+            if binary:
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+
+            response = self.handle_line(line)
+            if binary:
+                response = response.encode('utf-8')
+            wfile.write(response)
+            wfile.flush()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.daemon.serve(self.rfile, self.wfile)
+
+class UnixServer(socketserver.UnixStreamServer):
+    def __init__(self, path):
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.daemon = Daemon()
+
+def serve(path=None):
+    '''Serve requests on a Unix socket at path'''
+    if path is None:
+        path = default_path()
+        make_private_dir(os.path.dirname(path))
+
+    if os.path.exists(path):
+        # Remove the socket of a daemon that is no longer running
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except (IOError, OSError):
+            os.remove(path)
+        else:
+            raise IOError('A daemon is already running at %s' % path)
+        finally:
+            sock.close()
+
+    server = UnixServer(path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def request(request, path=None):
+    '''Send a request to the daemon at path and return the response'''
+    if path is None:
+        path = default_path()
+        make_private_dir(os.path.dirname(path))
+    check_owner(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        f = sock.makefile('rwb')
+        f.write((json.dumps(request) + '\n').encode('utf-8'))
+        f.flush()
+        line = f.readline()
+        f.close()
+    finally:
+        sock.close()
+
+    if not line:
+        raise IOError('No response from the daemon at %s' % path)
+
+    response = json.loads(line.decode('utf-8'))
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='reformat.daemon',
+        description='Keep a formatter running, or send it a file to format')
+    subparsers = parser.add_subparsers(dest='command')
+
+    server = subparsers.add_parser('serve', help='start the daemon')
+    server.add_argument('--socket', default=None,
+                        help='path of the Unix socket (default: %s)' %
+                        default_path())
+    server.add_argument('--stdio', action='store_true',
+                        help='read requests from stdin and write the '
+                        'responses to stdout instead')
+
+    client = subparsers.add_parser(
+        'format', help='format a file, or stdin, and write it to stdout')
+    client.add_argument('file', nargs='?', default=None)
+    client.add_argument('--socket', default=None)
+    client.add_argument('-i', '--in-place', action='store_true',
+                        help='write the result back to the file')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        if args.stdio:
+            Daemon().serve(sys.stdin, sys.stdout)
+        else:
+            serve(args.socket)
+        return 0
+
+    if args.command != 'format':
+        parser.print_usage()
+        return 1
+
+    if args.file is None:
+        text = sys.stdin.read()
+    else:
+        f = open(args.file, 'r')
+        text = f.read()
+        f.close()
+
+    try:
+        response = request({'text': text, 'set_indent': True,
+                            'extra_newlines': True}, args.socket)
+    except (IOError, OSError, RuntimeError) as e:
+        sys.stderr.write('reformat: %s\n' % e)
+        return 1
+
+    if args.in_place and args.file is not None:
+        f = open(args.file, 'w')
+        f.write(response['text'])
+        f.close()
+    else:
+        sys.stdout.write(response['text'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import os
+import re
+import sys
+import locale
+import shutil
+import subprocess
+
+from .reformat import reformat, LimitExceeded
+from .incremental import IncrementalFormatter
+from .batch import extensions
+
+# The lines of the new file in a hunk header of git diff
+hunk_header = re.compile(br'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@', re.M)
+
+def git(args, cwd=None, input=None):
+    '''Run git with args and return its output as bytes'''
+    process = subprocess.Popen(['git'] + args, cwd=cwd,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    output, error = process.communicate(input)
+    if process.returncode:
+        raise RuntimeError('git %s: %s' % (args[0], error.decode(
+            'utf-8', 'replace').strip()))
+    return output
+
+def native(output):
+    '''Filenames in the output of git as native strings'''
+    if str is bytes:
+        return output
+    return output.decode(sys.getfilesystemencoding())
+
+def toplevel(cwd=None):
+    return native(git(['rev-parse', '--show-toplevel'], cwd)).rstrip('\n')
+
+def diff_args(revision=None, staged=False):
+    '''The arguments of git diff that compare the working tree, or the
+    index when staged, with revision'''
+    args = ['diff', '--no-ext-diff', '--no-color']
+    if staged:
+        args.append('--cached')
+    args.append(revision or 'HEAD')
+    return args
+
+def changed_files(paths=(), revision=None, staged=False,
+                  extensions=extensions, cwd=None):
+    '''Returns the names of the files in paths that were added, copied,
+    modified or renamed since revision, in the working tree or in the
+    index when staged. Only files with one of extensions are included'''
+    # Outside of a repository git diff compares files instead
+    root = toplevel(cwd)
+    output = git(diff_args(revision, staged) +
+                 ['--name-only', '-z', '--diff-filter=ACMR', '--'] +
+                 list(paths), cwd)
+    files = []
+    for name in native(output).split('\0'):
+        if name and os.path.splitext(name)[1] in extensions:
+            files.append(os.path.join(root, name))
+    return files
+
+def changed_lines(fname, revision=None, staged=False):
+    '''Returns the ranges of lines of a file that changed since revision,
+    as tuples with the first line and the line after the last, starting
+    at 0. For removed lines the range is the line after them'''
+    output = git(diff_args(revision, staged) + ['-U0', '--', fname],
+                 os.path.dirname(os.path.abspath(fname)))
+    ranges = []
+    for match in hunk_header.finditer(output):
+        start = int(match.group(1))
+        count = 1
+        if match.group(2) is not None:
+            count = int(match.group(2))
+        if count:
+            ranges.append((start - 1, start - 1 + count))
+        else:
+            ranges.append((start, start + 1))
+    return ranges
+
+def read_staged(fname):
+    '''Returns the text of a file in the index, with the same newlines
+    as a file that is opened for reading, and the mode of the file. The
+    text is a native string, which is decoded on Python 3 only'''
+    cwd = os.path.dirname(os.path.abspath(fname))
+    name = os.path.basename(fname)
+    mode = git(['ls-files', '-s', '--', name], cwd).split()[0]
+    blob = git(['cat-file', 'blob', ':./' + name], cwd)
+    text = blob.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    if str is not bytes:
+        text = text.decode(locale.getpreferredencoding(False))
+    return text, mode.decode('ascii')
+
+def write_staged(fname, text, mode):
+    '''Store text as the content of a file in the index'''
+    cwd = os.path.dirname(os.path.abspath(fname))
+    name = os.path.basename(fname)
+    if not isinstance(text, bytes):
+        text = text.encode(locale.getpreferredencoding(False))
+    sha = git(['hash-object', '-w', '--stdin', '--path', name], cwd,
+              text).decode('ascii').strip()
+    git(['update-index', '--cacheinfo', mode, sha, name], cwd)
+
+def format_text(text, ranges=None, limits=None):
+    '''Format a text as the batch mode does, or only the statements that
+    contain the lines in ranges. limits is a dict with the limits of
+    reformat()'''
+    if ranges is None:
+        return reformat(text, set_indent=True, extra_newlines=True,
+                        **(limits or {}))
+
+    formatter = IncrementalFormatter(text)
+    formatter.set_indent = True
+    formatter.extra_newlines = True
+    for name, value in (limits or {}).items():
+        setattr(formatter, name, value)
+    return formatter.format_ranges(ranges)
+
+def format_changes(fname, revision=None, staged=False, lines=False,
+                   check=False, backup=True, limits=None):
+    '''Format a file that changed since revision, or only the lines that
+    changed. When staged, the file is formatted in the index, and in the
+    working tree as well if it is the same there. With check nothing is
+    written. Returns a tuple with the filename and its status, which is
+    either 'formatted', 'unchanged', 'not formatted', 'skipped' with the
+    limit that was exceeded, or an error'''
+    try:
+        ranges = None
+        if lines:
+            ranges = changed_lines(fname, revision, staged)
+
+        if staged:
+            text, mode = read_staged(fname)
+        else:
+            f = open(fname, 'r')
+            text = f.read()
+            f.close()
+
+        formatted = format_text(text, ranges, limits)
+        if formatted == text:
+            return fname, 'unchanged'
+        if check:
+            return fname, 'not formatted'
+
+        if staged:
+            write_staged(fname, formatted, mode)
+
+            # Only touch the working tree if it has no other changes. On
+            # Python 2 files opened for reading keep their newlines
+            f = open(fname, 'r')
+            same = f.read().replace('\r\n', '\n').replace('\r', '\n') == text
+            f.close()
+            if not same:
+                return fname, 'formatted'
+        elif backup and not os.path.exists(fname + '.bak'):
+            shutil.copyfile(fname, fname + '.bak')
+
+        f = open(fname, 'w')
+        f.write(formatted)
+        f.close()
+    except LimitExceeded as e:
+        return fname, 'skipped: %s' % e.reason
+    except Exception as e:
+        return fname, 'error: %s' % e
+
+    return fname, 'formatted'
+
+def run(paths=(), revision=None, staged=False, lines=False, check=False,
+        backup=True, extensions=extensions, out=None, limits=None):
+    '''Format the files in paths that changed since revision. The status
+    of every file is written to out. Returns the number of files that
+    could not be formatted or are not formatted'''
+    if out is None:
+        out = sys.stdout
+
+    errors = 0
+    for fname in changed_files(paths, revision, staged, extensions):
+        fname, status = format_changes(fname, revision, staged, lines,
+                                       check, backup, limits)
+        if status.startswith('error') or status == 'not formatted':
+            errors += 1
+        out.write('%s: %s\n' % (fname, status))
+        out.flush()
+
+    return errors
@@ -0,0 +1,194 @@
+import copy
+import bisect
+
+from .reformat import Formatter, ScopeSetter, ScopeMerger, StringReplacer, \
+    LimitExceeded, timer
+
+class IncrementalFormatter(Formatter):
+    '''Formatter for editors that formats a range of lines of a text. The
+    state of the formatter is stored in checkpoints after statements, so
+    formatting a range only processes the lines from the last checkpoint
+    before it up to the end of the range. Checkpoints stay valid when
+    lines after them change'''
+
+    def __init__(self, text, interval=100):
+        Formatter.__init__(self, [])
+        self.interval = interval
+
+        # Line numbers of the checkpoints and the stored states
+        self.numbers = [0]
+        self.states = [None]
+        self.options = None
+
+        self.update(text)
+
+    def update(self, text, start=None):
+        '''Set a new text. start is the first line that changed. If it is
+        not given it is found by comparing the lines'''
+        lines = text
+        if isinstance(text, str):
+            lines = text.splitlines(True)
+
+        if start is None:
+            old_lines = self.text
+            end = min(len(old_lines), len(lines))
+            start = 0
+            while start < end and old_lines[start] == lines[start]:
+                start += 1
+
+        self.text = lines
+        self.invalidate(start)
+
+    def invalidate(self, start=0):
+        '''Remove the checkpoints that depend on line start or later'''
+        index = bisect.bisect_right(self.numbers, start)
+        del self.numbers[max(index, 1):]
+        del self.states[max(index, 1):]
+
+    def save(self, number, splitter, set_scopes, merger):
+        index = bisect.bisect_left(self.numbers, number)
+        if index < len(self.numbers) and self.numbers[index] == number:
+            return
+
+        # Line parts share their scope states, so everything has to be
+        # copied at once
+        state = copy.deepcopy((splitter.line_type, set_scopes, merger,
+                               self.pos))
+        self.numbers.insert(index, number)
+        self.states.insert(index, state)
+
+    def restore(self, index):
+        '''Returns the splitter, scope setter and merger of a checkpoint'''
+        splitter = self.splitter([])
+        splitter.line_type = [StringReplacer.Normal]
+        self.line = []
+        self.pos = 0
+
+        state = self.states[index]
+        if state is None:
+            set_scopes = ScopeSetter(None, self.base_scope,
+                                     self.extra_newlines)
+            return splitter, set_scopes, ScopeMerger()
+
+        line_type, set_scopes, merger, self.pos = copy.deepcopy(state)
+        splitter.line_type = line_type
+        return splitter, set_scopes, merger
+
+    def iter_boundaries(self, start, stop):
+        '''Format the lines from the last checkpoint at or before start.
+        Yields the number of every line before which the state is
+        settled, together with the formatted lines since the previous
+        one, until the first such line at or after stop'''
+        options = (self.base_scope, self.set_indent, self.extra_newlines,
+                   self.splitter)
+        if options != self.options:
+            self.invalidate()
+            self.options = options
+
+        index = bisect.bisect_right(self.numbers, start) - 1
+        splitter, set_scopes, merger = self.restore(index)
+        set_scopes.max_depth = self.max_depth
+        deadline = None
+        if self.timeout is not None:
+            deadline = timer() + self.timeout
+        set_scopes.deadline = deadline
+        set_scopes.timeout = self.timeout
+        number = self.numbers[index]
+        checkpoint = number
+        yield number, []
+        if number >= stop:
+            return
+
+        lines = self.text
+        merged = []
+        formatted = []
+        while number < len(lines):
+            line = lines[number]
+            if self.max_line_length is not None and \
+               len(line.rstrip('\r\n')) > self.max_line_length:
+                raise LimitExceeded('Line %d is longer than %d characters' %
+                                    (number + 1, self.max_line_length))
+            if deadline is not None and timer() > deadline:
+                raise LimitExceeded('Formatting took longer than %g seconds' %
+                                    self.timeout)
+
+            splitter.line_parts = []
+            splitter.parse_line(line)
+            number += 1
+            for line_part in splitter.line_parts:
+                set_scopes.add(line_part)
+
+            end = number == len(lines)
+            if not end and not set_scopes.settled():
+                continue
+
+            if end:
+                set_scopes.finish()
+            for line_part in set_scopes.take_line_parts():
+                merger.add(line_part, merged)
+            if end:
+                merger.finish(merged)
+
+            formatted.extend(self.iter_format(merged))
+            del merged[:]
+
+            if end:
+                text = ''.join(self.line).rstrip()
+                if text:
+                    formatted.append(text)
+                yield number, formatted
+                return
+
+            if merger.prev_line_part is not None or ''.join(self.line):
+                # The last line is not finished yet
+                continue
+
+            if number - checkpoint >= self.interval:
+                self.save(number, splitter, set_scopes, merger)
+                checkpoint = number
+
+            yield number, formatted
+            formatted = []
+            if number >= stop:
+                return
+
+    def format_range(self, start, end):
+        '''Format the lines from start up to end. The range is extended to
+        the surrounding statements. Returns the first and last line
+        of the extended range, and the formatted text that replaces
+        them'''
+        first = 0
+        last = 0
+        output = []
+        for number, formatted in self.iter_boundaries(start, end):
+            last = number
+            if number <= start:
+                first = number
+                output = []
+            else:
+                output.extend(formatted)
+
+        return first, last, ''.join(output)
+
+    def format_ranges(self, ranges):
+        '''Format the statements that contain the lines in ranges, a list
+        of tuples with the first line and the line after the last.
+        Returns the text with only those statements replaced'''
+        changes = []
+        for start, end in sorted(ranges):
+            start = min(start, len(self.text))
+            end = min(max(end, start + 1), len(self.text))
+            if start >= end:
+                continue
+
+            if changes and start < changes[-1][1]:
+                # The statements overlap with the previous range
+                first, last, text = changes.pop()
+                start = first
+                end = max(end, last)
+            changes.append(self.format_range(start, end))
+
+        lines = list(self.text)
+        for first, last, text in reversed(changes):
+            lines[first:last] = [text]
+        return ''.join(lines)
@@ -0,0 +1,160 @@
+import sys
+
+from .reformat import reformat, timer
+
+class Instrumentation(object):
+    '''Base class for objects that are passed to the Formatter to see what
+    it is doing. start is called with the name of a stage or a handler
+    when it starts, and end with the name and the line part it produced
+    or formatted when it is done. The stages are split, scopes, merge and
+    format, and the handlers are called during the format stage. At the
+    end of a stage the line part is None. skipped is called instead for
+    handlers that can not change the line part. handled is called after
+    every handler with whether it changed the text. replaced is called
+    after every replacement that a handler makes through replace or
+    regex_replace with the search string or pattern, whether it changed
+    the text and the time it took. Handlers that set the text directly
+    make no replacements'''
+
+    def start(self, name):
+        pass
+
+    def end(self, name, line_part):
+        pass
+
+    def skipped(self, name):
+        pass
+
+    def handled(self, name, changed):
+        pass
+
+    def replaced(self, search, changed, elapsed):
+        pass
+
+class Collector(Instrumentation):
+    '''Collects the wall time of every stage and handler and the number of
+    line parts it processed. Stages are nested when they pull line parts
+    from the previous stage, so the time spent in a stage itself is
+    collected separately. For every handler and every replacement of a
+    handler, it counts how often it was invoked and changed the text, and
+    the time it took'''
+
+    def __init__(self):
+        self.counts = {}
+        self.times = {}
+        self.self_times = {}
+        self.skips = {}
+        self.changes = {}
+
+        # Invocations, changes and time for (handler, search) tuples
+        self.replacements = {}
+
+        # Name, start time and time spent in nested stages
+        self.stack = []
+
+    def start(self, name):
+        self.stack.append([name, timer(), 0.0])
+
+    def end(self, name, line_part):
+        stop = timer()
+        name, start, nested = self.stack.pop()
+        elapsed = stop - start
+
+        self.times[name] = self.times.get(name, 0.0) + elapsed
+        self.self_times[name] = self.self_times.get(name, 0.0) + \
+            elapsed - nested
+        if line_part is not None:
+            self.counts[name] = self.counts.get(name, 0) + 1
+        else:
+            self.counts.setdefault(name, 0)
+
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def skipped(self, name):
+        self.skips[name] = self.skips.get(name, 0) + 1
+
+    def handled(self, name, changed):
+        self.changes[name] = self.changes.get(name, 0) + changed
+
+    def replaced(self, search, changed, elapsed):
+        handler = None
+        if self.stack:
+            handler = self.stack[-1][0]
+
+        key = (handler, search)
+        counts = self.replacements.get(key)
+        if counts is None:
+            counts = [0, 0, 0.0]
+            self.replacements[key] = counts
+        counts[0] += 1
+        counts[1] += changed
+        counts[2] += elapsed
+
+    def summary(self):
+        '''Dict with the number of line parts, the number of line parts
+        that were skipped, the number of line parts that a handler changed,
+        the total time and the time spent in the stage or handler itself,
+        for every name'''
+        summary = {}
+        for name in set(self.times) | set(self.skips):
+            summary[name] = {'count': self.counts.get(name, 0),
+                             'skipped': self.skips.get(name, 0),
+                             'changed': self.changes.get(name, 0),
+                             'time': self.times.get(name, 0.0),
+                             'self': self.self_times.get(name, 0.0)}
+        return summary
+
+    def report(self):
+        '''Table of the summary, sorted by the time spent in every stage
+        or handler itself'''
+        summary = self.summary()
+        lines = ['%-40s %8s %8s %8s %10s %10s' %
+                 ('name', 'count', 'skipped', 'changed', 'time', 'self')]
+        for name in sorted(summary, key=lambda name: -summary[name]['self']):
+            item = summary[name]
+            lines.append('%-40s %8d %8d %8d %9.4fs %9.4fs' %
+                         (name, item['count'], item['skipped'],
+                          item['changed'], item['time'], item['self']))
+        return '\n'.join(lines) + '\n'
+
+    def replacement_report(self):
+        '''Table of every handler as a whole, with the search *, and of
+        its replacements, sorted by time. Handlers and replacements that
+        never changed anything are marked'''
+        lines = ['%-40s %-30s %8s %8s %10s' %
+                 ('handler', 'search', 'invoked', 'changed', 'time')]
+        items = list(self.replacements.items())
+        for name in self.changes:
+            items.append(((name, '*'), (self.counts.get(name, 0),
+                                        self.changes[name],
+                                        self.times.get(name, 0.0))))
+        items.sort(key=lambda item: -item[1][2])
+        for (handler, search), (invoked, changed, elapsed) in items:
+            lines.append('%-40s %-30s %8d %8d %9.4fs%s' %
+                         (handler, repr(search)[:30], invoked, changed,
+                          elapsed, '' if changed else '  never changed'))
+        return '\n'.join(lines) + '\n'
+
+def main(argv=None):
+    '''Format files and directories without writing them, and report where
+    the time went'''
+    from .batch import find_files
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    collector = Collector()
+    for fname in find_files(argv):
+        f = open(fname, 'r')
+        text = f.read()
+        f.close()
+        reformat(text, set_indent=True, extra_newlines=True,
+                 instrumentation=collector)
+
+    sys.stdout.write(collector.report())
+    sys.stdout.write('\n')
+    sys.stdout.write(collector.replacement_report())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+import multiprocessing
+
+from .reformat import reformat, Formatter, ScopeSetter, ScopeMerger, \
+    StringReplacer
+from .Scope import Scope, ScopeState
+
+# Texts with fewer lines are not split
+default_min_lines = 2000
+
+def split_points(lines, chunks):
+    '''Returns the numbers of the lines before which a text is split into
+    about chunks pieces. These are only guesses: lines at the top level
+    after a ; or } that start with code'''
+    points = []
+    size = len(lines) // chunks
+    for i in range(1, chunks):
+        number = max(i * size, points[-1] + 1 if points else 1)
+        end = min(number + size // 2, len(lines))
+        while number < end:
+            prev = lines[number - 1].rstrip()
+            line = lines[number]
+            if prev.endswith((';', '}')) and line.strip() and \
+               not line[0].isspace() and \
+               not line.startswith(('/*', '//', '"', '#', '}', '{')):
+                points.append(number)
+                break
+            number += 1
+    return points
+
+class ChunkFormatter(Formatter):
+    '''Formatter for a chunk of lines of a larger text, that starts at
+    the top of a statement in the base scope'''
+
+    # The states of the scope merger at the start, see get_shape
+    shape = ()
+    # Whether a new line is added before code that follows a comment at
+    # the start, because the previous line ended a statement
+    extra_newline = False
+
+    def format_chunk(self, last=False):
+        '''Format the lines and return the text, the scope, shape and
+        extra newline at the end and whether the state at the end is the
+        same as at the start of a text with those. Only then can the next
+        chunk be formatted separately starting with them. The last chunk
+        is formatted up to the end of the text'''
+        splitter = self.splitter(self.text)
+        set_scopes = ScopeSetter(splitter.iter_parse(), self.base_scope,
+                                 self.extra_newlines)
+        merger = ScopeMerger()
+        set_scopes.extra_newline = self.extra_newline
+        set_shape(set_scopes, merger, self.shape)
+
+        self.line = []
+        self.pos = 0
+        output = []
+        merged = []
+        for line_part in set_scopes.line_parts:
+            set_scopes.add(line_part)
+            if not set_scopes.settled():
+                continue
+
+            for line_part in set_scopes.take_line_parts():
+                merger.add(line_part, merged)
+            output.extend(self.iter_format(merged))
+            del merged[:]
+
+        if last:
+            set_scopes.finish()
+            for line_part in set_scopes.take_line_parts():
+                merger.add(line_part, merged)
+            merger.finish(merged)
+            output.extend(self.iter_format(merged))
+            text = ''.join(self.line).rstrip()
+            if text:
+                output.append(text)
+            return ''.join(output), None, True
+
+        shape = None
+        if splitter.line_type[-1] in [StringReplacer.Normal,
+                                      StringReplacer.Comment] and \
+           len(splitter.line_type) <= 2 and \
+           set_scopes.settled() and not set_scopes.new_line_parts and \
+           not ''.join(self.line):
+            shape = get_shape(set_scopes, merger)
+        start = (set_scopes.scope, shape,
+                 bool(self.extra_newlines and set_scopes.extra_newline))
+        return ''.join(output), start, shape is not None
+
+def get_states(set_scopes):
+    '''Returns a dict of the depth and state of the current scope state
+    and its parents'''
+    states = {}
+    state = set_scopes.scope_state
+    depth = len(set_scopes.scope)
+    while state is not None:
+        states[depth] = state
+        depth -= 1
+        state = state.parent
+    return states
+
+def is_unused(state):
+    return not (state.alignment or state.position or state.continuation or
+                state._indentation)
+
+def get_shape(set_scopes, merger):
+    '''Returns how the states of the scope merger relate to those of the
+    scope setter, or None if they can not be created again for the next
+    chunk. When a bracket was removed, a state is replaced by a copy of
+    its parent in place, so the merger may keep using a different state
+    for a scope than the scope setter. Line parts in a scope use the state
+    of the merger, but the indentation of brackets is taken from the
+    parent of a state, so which states are the same matters.
+
+    The shape has one item for every depth of the current scope:
+    None if the merger has no state at that depth, 'same' if it uses the
+    state of the scope setter, 'chain' for a different state with the
+    parent of the scope setter, 'merger' for one with the state of the
+    merger one level up as its parent and 'free' for one with an unused
+    parent'''
+    last_line_part = set_scopes.last_line_part
+    if set_scopes.scope_keyword or set_scopes.last_char == ')' or \
+       not set_scopes.start_of_statement or set_scopes.after_bracket or \
+       set_scopes.continuation or \
+       (last_line_part is not None and
+        last_line_part.type != StringReplacer.EOL) or \
+       merger.prev_line_part is not None:
+        return None
+
+    states = get_states(set_scopes)
+    for state in states.values():
+        if not is_unused(state):
+            return None
+
+    scopes = merger.scopes
+    if max(scopes or [0]) >= len(states):
+        # The merger still has a state of a scope that was left
+        return None
+
+    shape = []
+    for depth in range(len(states)):
+        state = scopes.get(depth)
+        if state is None:
+            shape.append(None)
+            continue
+        if state.scope is not states[depth].scope or not is_unused(state):
+            return None
+
+        if state is states[depth]:
+            shape.append('same')
+        elif depth == 0:
+            shape.append('free')
+        elif state.parent is states[depth - 1]:
+            shape.append('chain')
+        elif state.parent is scopes.get(depth - 1):
+            shape.append('merger')
+        elif is_unused(state.parent):
+            shape.append('free')
+        else:
+            return None
+
+    return tuple(shape)
+
+def set_shape(set_scopes, merger, shape):
+    '''Create the states of the merger for a shape from get_shape'''
+    states = get_states(set_scopes)
+    scopes = merger.scopes
+    for depth, kind in enumerate(shape):
+        if kind is None:
+            continue
+        if kind == 'same':
+            scopes[depth] = states[depth]
+            continue
+
+        parent = None
+        if kind == 'chain':
+            parent = states[depth - 1]
+        elif kind == 'merger':
+            parent = scopes[depth - 1]
+        elif depth:
+            parent = ScopeState.from_scope(states[depth - 1].scope)
+        scopes[depth] = ScopeState(parent, states[depth].item)
+
+def format_chunk(args):
+    '''Format a chunk in a worker process'''
+    lines, start, set_indent, extra_newlines, last = args
+    formatter = ChunkFormatter(lines)
+    formatter.base_scope, formatter.shape, formatter.extra_newline = start
+    formatter.set_indent = set_indent
+    formatter.extra_newlines = extra_newlines
+    try:
+        return formatter.format_chunk(last)
+    except Exception:
+        # The chunk did not start where it was expected to
+        return None, None, False
+
+def reformat_parallel(text, base_scope=None, set_indent=False,
+                      extra_newlines=False, jobs=None, pool=None,
+                      min_lines=None):
+    '''Same as reformat, but formats the text in chunks in a pool of jobs
+    processes. The chunks are formatted with the scope, shape and extra
+    newline at the end of the previous chunk. Chunks that turn out to have
+    started with a different one are formatted again, and a chunk of which
+    the end can not be continued separately is joined with the next one,
+    so the result is always the same as that of reformat. Texts with fewer
+    than min_lines lines are formatted without splitting them'''
+    lines = text
+    if isinstance(text, str):
+        lines = text.splitlines(True)
+
+    if min_lines is None:
+        min_lines = default_min_lines
+    if jobs is None and pool is None:
+        jobs = multiprocessing.cpu_count()
+    if (pool is None and jobs == 1) or len(lines) < min_lines:
+        return reformat(lines, base_scope, set_indent, extra_newlines)
+
+    chunks = []
+    start = 0
+    for number in split_points(lines, jobs or multiprocessing.cpu_count()):
+        chunks.append(lines[start:number])
+        start = number
+    chunks.append(lines[start:])
+
+    # Most chunks start at the top level, where the merger uses the state
+    # of the scope setter. A new line is added after code that ends with ;
+    base_scope = Scope(base_scope)
+    starts = [(base_scope, (None,), False)]
+    for chunk in chunks[:-1]:
+        starts.append((base_scope, ('same',), bool(
+            extra_newlines and chunk[-1].rstrip().endswith(';'))))
+    results = [None] * len(chunks)
+
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(jobs)
+
+    try:
+        # Number of chunks of which the result is final
+        done = 0
+        while done < len(chunks):
+            todo = [i for i in range(done, len(chunks)) if results[i] is None]
+            args = [(chunks[i], starts[i], set_indent, extra_newlines,
+                     i == len(chunks) - 1) for i in todo]
+            for i, result in zip(todo, pool.map(format_chunk, args)):
+                results[i] = result
+
+            while done < len(chunks):
+                if done == 0:
+                    done = 1
+                    continue
+
+                text, start, clean = results[done - 1]
+                if not clean:
+                    # Continue the previous chunk instead
+                    chunks[done - 1:done + 1] = \
+                        [chunks[done - 1] + chunks[done]]
+                    del starts[done]
+                    del results[done]
+                    results[done - 1] = None
+                    done -= 1
+                    break
+
+                if start != starts[done]:
+                    guess = starts[done][:2]
+                    starts[done] = start
+                    results[done] = None
+                    if start[:2] != guess:
+                        # Later chunks probably started in the same scope
+                        for i in range(done + 1, len(chunks)):
+                            if starts[i][:2] == guess:
+                                starts[i] = start[:2] + starts[i][2:]
+                                results[i] = None
+                    break
+
+                done += 1
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    if results[-1][0] is None:
+        # Formatting failed, so fail the same way as reformat
+        return reformat(lines, base_scope, set_indent, extra_newlines)
+
+    return ''.join(result[0] for result in results)
@@ -1,8 +1,32 @@
 import sys
 import os
 import re
+import time
+import mmap
+import codecs
+import locale
+import shutil
+import tempfile
 
-from .Scope import Scope
+from .Scope import Scope, ScopeState
+
+if hasattr(time, 'perf_counter'):
+    timer = time.perf_counter
+else:
+    timer = time.time
+
+class LimitExceeded(Exception):
+    '''Raised when formatting a text goes over one of the limits of the
+    formatter, which are meant for inputs that would take very long, like
+    minified code. reason tells which limit it was'''
+
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+class Cancelled(Exception):
+    '''Raised when the cancelled event of the formatter is set while it is
+    formatting, by another thread'''
 
 class StringReplacer(object):
     Normal = 0
@@ -15,6 +39,20 @@ class StringReplacer(object):
     keywords = ['for', 'if', 'while', 'return']
     alignments = ['(', '[', '<', '<<', '>>']
 
+    # Operators that get spaces around them, sorted by length
+    operators = ['=', '+', '/', '-', '<', '>', '%', '*', '&', '|', '^', ':',
+                 '?', '<=', '>=', '==', '!=', '|=', '&=', '*=', '+=', '-=',
+                 '/=', '%=', '^=', '<<', '>>', '&&', '||', '//', '<<=', '>>=']
+
+    # Runs of characters that occur in the operators and spaces
+    operator_runs = re.compile(r'[ !%&*+\-/:<=>?^|]+')
+    spaced_operator_runs = {}
+
+    # Many line parts are created, so they don't get a __dict__
+    __slots__ = ('text', 'type', 'start_of_line', 'start_of_statement',
+                 'end_of_statement', 'after_bracket', 'continuation',
+                 'scope', 'scope_state', 'indentation', 'counter')
+
     def __init__(self, text, type, first = True, scope = None):
         self.text = text
         self.type = type
@@ -24,23 +62,41 @@ class StringReplacer(object):
         self.after_bracket = False
         self.continuation = False
 
-        if isinstance(scope, Scope):
-            self.scope = scope
-        else:
-            self.scope = Scope(scope)
+        self.scope = Scope(scope)
+        self.scope_state = None
+
+        # Object of which the replaced method is called after every
+        # replacement through replace or regex_replace, see Instrumentation
+        self.counter = None
 
         self.indentation = ''
-        if self.start_of_line:
-            self.indentation = re.match('^\s*', self.text).group(0)
+        if first:
+            self.indentation = text[:len(text) - len(text.lstrip())]
 
     def replace(self, search, replace):
         if self.type in [self.Normal]:
+            if self.counter is not None:
+                return self.count_replace(search, replace, False)
             self.text = self.text.replace(search, replace)
 
     def regex_replace(self, search, replace):
         if self.type in [self.Normal]:
+            if self.counter is not None:
+                return self.count_replace(search, replace, True)
             self.text = re.sub(search, replace, self.text)
 
+    def count_replace(self, search, replace, regex):
+        '''Replace and tell the counter whether the text changed and how
+        long it took'''
+        text = self.text
+        start = timer()
+        if regex:
+            self.text = re.sub(search, replace, text)
+        else:
+            self.text = text.replace(search, replace)
+        elapsed = timer() - start
+        self.counter.replaced(search, self.text != text, elapsed)
+
     def repeated_replace(self, search, replace):
         text = self.text
         self.replace(search, replace)
@@ -70,34 +126,124 @@ class StringReplacer(object):
                                   op[0]+op[1]+op[2])
             self.replace(op, ' '+op+' ')
             self.replace('  '+op, ' '+op)
-            self.repeated_replace(op+'  ', op+' ')
+
+            # Collapse all spaces after the operator at once
+            self.regex_replace(re.escape(op)+'  +', op+' ')
+
+    def space_operators(self):
+        '''Put spaces around the operators. This gives the same result as
+        handle_operators with the operators attribute followed by joining
+        : : to ::, but without scanning the text for every operator'''
+        if self.type in [self.Normal]:
+            self.text = self.operator_runs.sub(self.space_operator_run,
+                                               self.text)
+
+    @classmethod
+    def space_operator_run(cls, match):
+        '''None of the replacements in handle_operators can match across
+        a character that is not in an operator, so every run of operator
+        characters can be handled on its own. The result for each run is
+        cached, since the same runs occur over and over again'''
+        run = match.group()
+        try:
+            return cls.spaced_operator_runs[run]
+        except KeyError:
+            pass
+
+        line_part = cls(run, cls.Normal, False)
+        line_part.handle_operators(list(cls.operators))
+        line_part.replace(' : : ', '::')
+
+        if len(cls.spaced_operator_runs) > 4096:
+            cls.spaced_operator_runs.clear()
+        cls.spaced_operator_runs[run] = line_part.text
+        return line_part.text
 
     def handle_pointers(self, pointer_type='*'):
-        '''Handles pointers in C-type languages'''
+        '''Handles pointers in C-type languages. The spaces after the
+        pointers are removed and put back in a single pass each, which
+        gives the same result as repeating the regular expressions until
+        nothing changes'''
+        if self.type not in [self.Normal]:
+            return
+
+        text = self.text
         escaped_pointer_type = re.escape(pointer_type)
 
-        # Pointers in function definitions and the global scope
+        # Pointers in function definitions and the global scope, up to
+        # any operator
+        end = 0
         if self.scope.is_global():
-            self.repeated_regex_replace('^([^=\+\-/%]+)'+escaped_pointer_type+' ', '\g<1>'+pointer_type)
+            match = re.search('[=\+\-/%]', text)
+            end = match.start() if match else len(text)
 
         # lvalue pointers, up to any operator or bracket
         if self.start_of_statement:
             counts = True
-            for s in self.scope:
-                for b in self.brackets:
-                    if b in s:
-                        counts = False
+            for b in self.brackets:
+                if b in self.scope:
+                    counts = False
             if self.scope.last in self.keywords:
                 counts = False
             if counts:
-                self.repeated_regex_replace(
-                    '^([^=\+\-/%\(]+)'+escaped_pointer_type+' ',
-                    '\g<1>'+pointer_type)
+                match = re.search('[=\+\-/%\(]', text)
+                end = max(end, match.start() if match else len(text))
+
+        # Remove the spaces after all pointers in that part, except for
+        # a pointer at the start
+        if end > 1:
+            text = text[0] + re.sub(escaped_pointer_type+' +', pointer_type,
+                                    text[1:end]) + text[end:]
+
+        # Put back spaces when an operator with more than 1 char and a
+        # word were before the *. After a pointer that gets a space, the
+        # next pointer also has a space before it
+        shifts = [pos for pos in (text.find('>>'), text.find('<<'))
+                  if pos >= 0]
+        if shifts:
+            match = re.compile('\w').search(text, min(shifts) + 2)
+            if match:
+                start = match.end()
+                rest = text[start:]
+
+                def space_pointers(match):
+                    pointers = len(match.group(1))
+                    if match.end() < len(rest) and rest[match.end()] != ' ':
+                        return ' ' + (pointer_type+' ') * pointers
+                    return ' ' + (pointer_type+' ') * (pointers-1) + \
+                        pointer_type
+
+                text = text[:start] + re.sub(
+                    ' ('+escaped_pointer_type+'+)', space_pointers, rest)
+
+        self.text = text
+
+    def handle_references(self):
+        '''Handles references in C-type languages'''
+        self.handle_pointers('&')
+
+    def handle_dereference(self):
+        '''Pointer dereference ->'''
+        self.regex_replace('\s*\-\s*>\s*', '->')
 
-        # Put back spaces when an operator with more than 1 char was before
-        # the *
-        self.repeated_regex_replace('(>>.*\w+.*) '+escaped_pointer_type+'([^ ])', '\g<1> '+pointer_type+' \g<2>')
-        self.repeated_regex_replace('(<<.*\w+.*) '+escaped_pointer_type+'([^ ])', '\g<1> '+pointer_type+' \g<2>')
+    def handle_indices(self):
+        '''Remove spaces in indices'''
+        if '[' in self.scope.last:
+            for op in self.operators:
+                self.replace(' '+op+' ', op)
+
+    def handle_comments(self):
+        '''Comments at the start of a line part should stay there'''
+        self.regex_replace('^ //', '//')
+
+    def handle_start_of_statement(self):
+        '''Remove spaces before statements that don't start a line'''
+        if self.start_of_statement and not self.start_of_line:
+            self.regex_replace('^\s+', '')
+
+    def handle_includes(self):
+        '''Includes should have a space'''
+        self.replace('include<', 'include <')
 
     def handle_templates(self):
         '''Handle C++ templates'''
@@ -123,8 +269,16 @@ class StringReplacer(object):
 
     def handle_colon(self):
         '''Handle colons at the end of the line like in public:'''
-        if 'class' in self.scope and self.start_of_statement:
-            self.repeated_regex_replace('^([^=\+\-/%\(]+) :', '\g<1>:')
+        if 'class' in self.scope and self.start_of_statement and \
+           self.type in [self.Normal]:
+            # Remove all spaces before colons up to any operator or
+            # bracket, but keep the first character
+            text = self.text
+            match = re.search('[=\+\-/%\(]', text)
+            end = match.start() if match else len(text)
+            if end > 1:
+                self.text = text[0] + re.sub(' +:', ':', text[1:end]) + \
+                    text[end:]
 
     def handle_exponent(self):
         '''Handle exponents like 1.1e-1'''
@@ -132,6 +286,9 @@ class StringReplacer(object):
 
     def handle_unary(self, operators=None):
         '''Handle unary operators like -1'''
+        if operators is None:
+            operators = ['+', '-', '&', '*']
+
         for op in operators:
             eop = re.escape(op)
             self.regex_replace('([^\w\]\)'+eop+']) '+eop+' ', '\g<1> '+op)
@@ -177,23 +334,24 @@ class StringReplacer(object):
 
     def handle_alignment(self):
         '''Set the position of brackets in the scope'''
+        state = self.scope_state
         if self.type == self.Normal and self.scope.last and \
-           self.scope.indentation == 0 and \
+           state.indentation == 0 and \
            self.scope.last in self.brackets:
             if self.text == self.scope.last:
                 # Bracket at the end of the line
                 indentation = 1
-                if self.scope.parent:
-                    indentation += self.scope.parent.indentation
-                self.scope.indentation = indentation
-            elif self.scope.last in self.scope.alignment:
-                self.scope.position = self.scope.alignment[self.scope.last] + 1
+                if len(self.scope) > 1:
+                    indentation += state.parent.indentation
+                state.indentation = indentation
+            elif self.scope.last in state.alignment:
+                state.position = state.alignment[self.scope.last] + 1
         if self.type == self.Normal and \
-           self.scope.indentation == 0 and \
+           state.indentation == 0 and \
            self.start_of_line:
-            for item in self.scope.alignment.keys():
+            for item in state.alignment.keys():
                 if self.text.lstrip().startswith(item):
-                    self.scope.position = self.scope.alignment[item]
+                    state.position = state.alignment[item]
 
     def set_indentation(self):
         '''Set the indentation of the line part based on the scope'''
@@ -214,14 +372,15 @@ class StringReplacer(object):
             self.indentation = ''
             return
 
-        if self.scope.position:
-            self.indentation = ' ' * self.scope.position
-            self.scope.position = 0
+        state = self.scope_state
+        if state.position:
+            self.indentation = ' ' * state.position
+            state.position = 0
             return
 
-        self.scope.continuation = self.continuation
+        state.continuation = self.continuation
 
-        scopes = self.scope.indented_scopes()
+        scopes = state.indented_scopes()
 
         # Class definitions (public is not indented,
         # but function definitions are)
@@ -253,10 +412,12 @@ class ScopeSetter(object):
         self.new_line_part = ''
 
         self.scope = Scope(base_scope)
+        self.scope_state = ScopeState.from_scope(self.scope)
         self.base_scope = Scope(base_scope)
 
         self.extra_newlines = extra_newlines
         self.extra_newline = False
+        self.last_line_part = None
 
         self.scope_keyword = ''
         self.last_char = ''
@@ -266,14 +427,46 @@ class ScopeSetter(object):
         self.after_bracket = False
         self.continuation = False
 
+        # Maximum number of nested scopes, or None
+        self.max_depth = None
+
+        # Event that stops parsing when it is set, or None
+        self.cancelled = None
+
+        # Time after which parsing stops, with the timeout it came from,
+        # or None
+        self.deadline = None
+        self.timeout = None
+
     def pop_scope(self):
         self.scope = self.scope.parent
+        self.scope_state = self.scope_state.parent
 
     def add_scope(self, item):
         self.scope = Scope(self.scope, item)
+        self.scope_state = ScopeState(self.scope_state, item)
+        if self.max_depth is not None and len(self.scope) > self.max_depth:
+            raise LimitExceeded('Scopes are nested deeper than %d' %
+                                self.max_depth)
+
+    def append(self, line_part):
+        self.new_line_parts.append(line_part)
+        self.last_line_part = line_part
+
+    def remove_scope(self, item):
+        '''Remove the outermost scope that contains item. This also changes
+        the scope of the line parts that were already added in it'''
+        self.scope_state.remove(item)
+        self.scope = self.scope_state.scope
 
     def add_line_part(self, closing = False):
         '''Add a new line part to the new_line_parts list'''
+        # A single line part of minified code can take seconds
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise Cancelled('Formatting was cancelled')
+        if self.deadline is not None and timer() > self.deadline:
+            raise LimitExceeded('Formatting took longer than %g seconds' %
+                                self.timeout)
 
         self.handle_extra_newlines()
 
@@ -296,8 +489,9 @@ class ScopeSetter(object):
         if closing:
             self.continuation = False
 
-        self.new_line_parts.append(StringReplacer(
+        self.append(StringReplacer(
             self.new_line_part, StringReplacer.Normal, self.start_of_line, self.scope))
+        self.new_line_parts[-1].scope_state = self.scope_state
         self.new_line_parts[-1].start_of_statement = self.start_of_statement
         self.new_line_parts[-1].end_of_statement = closing
         self.new_line_parts[-1].after_bracket = self.after_bracket
@@ -307,7 +501,7 @@ class ScopeSetter(object):
         if closing:
             self.remove_bracket_scopes()
             if 'initializer list' in self.scope:
-                self.scope.remove('initializer list')
+                self.remove_scope('initializer list')
 
         if self.start_of_line:
             self.continuation = False
@@ -329,10 +523,11 @@ class ScopeSetter(object):
         if not self.extra_newline:
             return
 
-        if len(self.new_line_parts) and \
-           self.new_line_parts[-1].type != StringReplacer.EOL:
-            self.new_line_parts.append(StringReplacer(
+        if self.last_line_part is not None and \
+           self.last_line_part.type != StringReplacer.EOL:
+            self.append(StringReplacer(
                 '', StringReplacer.EOL, self.start_of_line))
+            self.new_line_parts[-1].scope_state = ScopeState()
 
             self.start_of_line = True
         self.extra_newline = False
@@ -349,133 +544,211 @@ class ScopeSetter(object):
            char == ')':
             while self.scope.last in StringReplacer.brackets and \
                   self.scope.last != '(':
-                self.scope.remove(self.scope.last)
+                self.remove_scope(self.scope.last)
 
     def parse(self):
         '''Parse the line_parts list that was set in the constructor'''
         self.continuation = False
         self.start_of_statement = True
         for line_part in self.line_parts:
-            self.start_of_line = line_part.start_of_line
-            if line_part.type == StringReplacer.Normal:
-                self.new_line_part = ''
-                for char in line_part.text:
-                    self.remove_bracket_scopes(char, False)
+            self.add(line_part)
+        self.finish()
 
-                    if char in line_part.brackets.keys():
-                        self.add_line_part()
-                        self.new_line_part += char
-                        self.add_scope(self.scope_keyword or char)
-                        self.scope_keyword = ''
-                        self.add_line_part()
-                    elif char == '{':
-                        self.add_line_part()
-                        if self.scope.last in ['initializer list', 'flow']:
-                            self.pop_scope()
-                        self.new_line_part += char
-                        self.extra_newline = True
-                        self.add_line_part(True)
-                        self.add_scope(self.scope_keyword or char)
-                        self.scope_keyword = ''
-                        self.extra_newline = True
-                    elif char == '}':
-                        self.add_line_part(True)
-                        self.pop_scope()
-                        self.scope_keyword = ''
-                        self.new_line_part += char
-                        self.add_line_part(True)
-                    elif char == ')' and self.scope.last in line_part.keywords:
-                        self.new_line_part += char
-                        self.add_line_part()
-                        self.after_bracket = True
-                        self.pop_scope()
-                        self.add_scope('flow')
-                        self.scope_keyword = ''
-                    elif char in line_part.brackets.get(
-                            self.scope.last, []):
-                        self.new_line_part += char
-                        self.add_line_part()
-                        self.after_bracket = True
-                        self.start_of_statement = False
-                        self.continuation = False
-                        self.pop_scope()
-                        self.scope_keyword = ''
-                    elif char == ':' and self.last_char == ')':
-                        self.add_line_part(True)
-                        self.add_scope('initializer list')
-                        self.new_line_part += char
-                        self.add_line_part()
-                    elif char == ';':
-                        self.new_line_part += char
-                        self.add_line_part(True)
-                        if not self.scope.last in line_part.keywords:
-                            self.extra_newline = True
-                    elif char == ',' and self.scope.last in line_part.brackets:
-                        self.new_line_part += char
-                        self.add_line_part()
-                        self.start_of_statement = True
-                    else:
-                        self.new_line_part += char
-
-                    # Store the last char to be able to detect initializer lists
-                    if not re.match('\s', char):
-                        self.last_char = char
-
-                    for keyword in ['private', 'protected', 'public']:
-                        if re.match('^\s*'+keyword+':$', self.new_line_part):
-                            self.add_line_part()
-                if self.new_line_part.rstrip():
-                    self.add_line_part()
+        self.new_line_parts = self.take_line_parts()
+        return self.new_line_parts
 
-                    # There was stuff on this line that
-                    # continues on the next line
-                    if self.scope.last != 'initializer list':
-                        self.continuation = True
-                    self.start_of_statement = False
-            else:
-                line_part.scope = self.scope
-                self.new_line_parts.append(line_part)
+    def iter_parse(self):
+        '''Generator version of parse that yields line parts as soon as
+        their scopes can no longer change'''
+        self.continuation = False
+        self.start_of_statement = True
+        for line_part in self.line_parts:
+            self.add(line_part)
+            if self.settled():
+                for new_line_part in self.take_line_parts():
+                    yield new_line_part
+        self.finish()
+
+        for new_line_part in self.take_line_parts():
+            yield new_line_part
+
+    def settled(self):
+        '''Whether the scopes of the line parts that were added so far are
+        final. Only scopes that are not brackets after all and initializer
+        lists are ever removed'''
+        scope = self.scope
+        return not (scope.count('<') or scope.count('[') or
+                    scope.count('initializer list'))
+
+    def take_line_parts(self):
+        '''Returns the line parts that were added and clears the list'''
+        new_line_parts = self.new_line_parts
+        self.new_line_parts = []
+
+        # Scopes may have changed after the line parts were added
+        for line_part in new_line_parts:
+            line_part.scope = line_part.scope_state.scope
 
+        return new_line_parts
+
+    def finish(self):
+        '''Handle the end of the file'''
         self.remove_bracket_scopes()
 
         # All scopes should be closed at the end of the file
         # assert self.scope == self.base_scope
 
-        return self.new_line_parts
+    def add(self, line_part):
+        '''Add one of the line parts from the LineSplitter'''
+        self.start_of_line = line_part.start_of_line
+        if line_part.type == StringReplacer.Normal:
+            self.new_line_part = ''
+            for char in line_part.text:
+                self.remove_bracket_scopes(char, False)
+
+                if char in line_part.brackets.keys():
+                    self.add_line_part()
+                    self.new_line_part += char
+                    self.add_scope(self.scope_keyword or char)
+                    self.scope_keyword = ''
+                    self.add_line_part()
+                elif char == '{':
+                    self.add_line_part()
+                    if self.scope.last in ['initializer list', 'flow']:
+                        self.pop_scope()
+                    self.new_line_part += char
+                    self.extra_newline = True
+                    self.add_line_part(True)
+                    self.add_scope(self.scope_keyword or char)
+                    self.scope_keyword = ''
+                    self.extra_newline = True
+                elif char == '}':
+                    self.add_line_part(True)
+                    self.pop_scope()
+                    self.scope_keyword = ''
+                    self.new_line_part += char
+                    self.add_line_part(True)
+                elif char == ')' and self.scope.last in line_part.keywords:
+                    self.new_line_part += char
+                    self.add_line_part()
+                    self.after_bracket = True
+                    self.pop_scope()
+                    self.add_scope('flow')
+                    self.scope_keyword = ''
+                elif char in line_part.brackets.get(
+                        self.scope.last, []):
+                    self.new_line_part += char
+                    self.add_line_part()
+                    self.after_bracket = True
+                    self.start_of_statement = False
+                    self.continuation = False
+                    self.pop_scope()
+                    self.scope_keyword = ''
+                elif char == ':' and self.last_char == ')':
+                    self.add_line_part(True)
+                    self.add_scope('initializer list')
+                    self.new_line_part += char
+                    self.add_line_part()
+                elif char == ';':
+                    self.new_line_part += char
+                    self.add_line_part(True)
+                    if not self.scope.last in line_part.keywords:
+                        self.extra_newline = True
+                elif char == ',' and self.scope.last in line_part.brackets:
+                    self.new_line_part += char
+                    self.add_line_part()
+                    self.start_of_statement = True
+                else:
+                    self.new_line_part += char
+
+                # Store the last char to be able to detect initializer lists
+                if not re.match('\s', char):
+                    self.last_char = char
+
+                for keyword in ['private', 'protected', 'public']:
+                    if re.match('^\s*'+keyword+':$', self.new_line_part):
+                        self.add_line_part()
+            if self.new_line_part.rstrip():
+                self.add_line_part()
+
+                # There was stuff on this line that
+                # continues on the next line
+                if self.scope.last != 'initializer list':
+                    self.continuation = True
+                self.start_of_statement = False
+        else:
+            line_part.scope = self.scope
+            line_part.scope_state = self.scope_state
+            self.append(line_part)
 
     def merge_equal_scopes(self):
         '''Merge line parts that have equal scopes'''
-        prev_line_part = None
-        new_line_parts = []
-        scopes = {}
-        for line_part in self.new_line_parts:
-
-            scope_len = len(line_part.scope)
-            if scope_len in scopes and \
-               line_part.scope == scopes[scope_len]:
-                line_part.scope = scopes[scope_len]
-            else:
-                scopes[scope_len] = line_part.scope
-            if scope_len+1 in scopes:
-                del scopes[scope_len+1]
+        self.new_line_parts = list(
+            self.iter_merge_equal_scopes(self.new_line_parts))
+        return self.new_line_parts
 
-            if not prev_line_part:
-                new_line_parts.append(line_part)
-                prev_line_part = line_part
-                continue
+    def iter_merge_equal_scopes(self, line_parts):
+        '''Generator version of merge_equal_scopes that yields line parts
+        as soon as nothing can be merged into them anymore'''
+        merger = ScopeMerger()
+        merged = []
+        for line_part in line_parts:
+            merger.add(line_part, merged)
+            if merged:
+                for merged_line_part in merged:
+                    yield merged_line_part
+                del merged[:]
+
+        merger.finish(merged)
+        for merged_line_part in merged:
+            yield merged_line_part
+
+class ScopeMerger(object):
+    '''Merges line parts that have equal scopes. Line parts are added one
+    by one, and are passed on as soon as nothing can be merged into them
+    anymore'''
+
+    def __init__(self):
+        self.prev_line_part = None
+        self.scopes = {}
+
+    def add(self, line_part, merged):
+        '''Add a line part and append the finished line parts to merged'''
+        scopes = self.scopes
+
+        # Line parts with equal scopes share their state
+        scope_len = len(line_part.scope)
+        if scope_len in scopes and \
+           line_part.scope is scopes[scope_len].scope:
+            line_part.scope_state = scopes[scope_len]
+        else:
+            scopes[scope_len] = line_part.scope_state
+        if scope_len+1 in scopes:
+            del scopes[scope_len+1]
+
+        prev_line_part = self.prev_line_part
+        if prev_line_part and \
+           line_part.type == prev_line_part.type and \
+           line_part.scope is prev_line_part.scope and \
+           not line_part.type == StringReplacer.EOL:
+            prev_line_part.text += line_part.text
+            prev_line_part.end_of_statement = line_part.end_of_statement
+            return
 
-            if line_part.type == prev_line_part.type and \
-               line_part.scope == prev_line_part.scope and \
-               not line_part.type == StringReplacer.EOL:
-                prev_line_part.text += line_part.text
-                prev_line_part.end_of_statement = line_part.end_of_statement
-                continue
+        if prev_line_part:
+            merged.append(prev_line_part)
+        self.prev_line_part = line_part
 
-            new_line_parts.append(line_part)
-            prev_line_part = line_part
+        # Nothing is merged into end of lines
+        if line_part.type == StringReplacer.EOL:
+            merged.append(line_part)
+            self.prev_line_part = None
 
-        self.new_line_parts = new_line_parts
-        return self.new_line_parts
+    def finish(self, merged):
+        '''Append the last line part to merged'''
+        if self.prev_line_part:
+            merged.append(self.prev_line_part)
+        self.prev_line_part = None
 
 class LineSplitter(object):
     def __init__(self, text):
@@ -502,71 +775,220 @@ class LineSplitter(object):
         self.line_type = [StringReplacer.Normal]
 
         self.line_parts = []
-        for line_num, line in enumerate(self.lines):
-            self.current_line_part = ''
-            if self.line_type[-1] == StringReplacer.Comment:
-                self.line_type.pop()
+        for line in self.lines:
+            self.parse_line(line)
+        return self.line_parts
 
-            self.start_of_line = True
-            for pos, char in enumerate(line):
-                self.current_line_part += char
-
-                if self.line_type[-1] == StringReplacer.MultilineComment:
-                    if self.current_line_part.endswith('*/'):
-                        self.add_line_part(StringReplacer(
-                            self.current_line_part, self.line_type.pop(), self.start_of_line))
-                        continue
-                    else:
-                        continue
-
-                if self.current_line_part.endswith('/*'):
+    def iter_parse(self):
+        '''Generator version of parse that yields the line parts of every
+        line as soon as it is parsed'''
+        self.line_type = [StringReplacer.Normal]
+
+        for line in self.lines:
+            self.line_parts = []
+            self.parse_line(line)
+            for line_part in self.line_parts:
+                yield line_part
+        self.line_parts = []
+
+    def parse_line(self, line):
+        self.current_line_part = ''
+        if self.line_type[-1] == StringReplacer.Comment:
+            self.line_type.pop()
+
+        self.start_of_line = True
+        for pos, char in enumerate(line):
+            self.current_line_part += char
+
+            if self.line_type[-1] == StringReplacer.MultilineComment:
+                if self.current_line_part.endswith('*/'):
                     self.add_line_part(StringReplacer(
-                        self.current_line_part[:-2], self.line_type[-1], self.start_of_line))
-                    self.line_type.append(StringReplacer.MultilineComment)
-                    self.current_line_part += '/*'
+                        self.current_line_part, self.line_type.pop(), self.start_of_line))
                     continue
-
-                if char == '"':
-                    if self.line_type[-1] == StringReplacer.String:
-                        self.add_line_part(StringReplacer(
-                            self.current_line_part, self.line_type.pop(), self.start_of_line))
-                    else:
-                        self.add_line_part(StringReplacer(
-                            self.current_line_part, self.line_type[-1], self.start_of_line))
-                        self.line_type.append(StringReplacer.String)
+                else:
                     continue
 
-                if self.current_line_part.endswith('//'):
-                    self.add_line_part(StringReplacer(
-                        self.current_line_part[:-2], self.line_type[-1], self.start_of_line))
-                    self.line_type.append(StringReplacer.Comment)
-                    self.current_line_part += line[pos-1:]
-                    break
+            if self.current_line_part.endswith('/*'):
+                self.add_line_part(StringReplacer(
+                    self.current_line_part[:-2], self.line_type[-1], self.start_of_line))
+                self.line_type.append(StringReplacer.MultilineComment)
+                self.current_line_part += '/*'
+                continue
 
-                if self.current_line_part.lstrip() == '#':
+            if char == '"':
+                if self.line_type[-1] == StringReplacer.String:
                     self.add_line_part(StringReplacer(
-                        self.current_line_part[:-1], self.line_type[-1], self.start_of_line))
-                    self.line_type.append(StringReplacer.Comment)
-                    self.current_line_part += line[pos:]
+                        self.current_line_part, self.line_type.pop(), self.start_of_line))
+                else:
+                    self.add_line_part(StringReplacer(
+                        self.current_line_part, self.line_type[-1], self.start_of_line))
+                    self.line_type.append(StringReplacer.String)
+                continue
+
+            if self.current_line_part.endswith('//'):
+                self.add_line_part(StringReplacer(
+                    self.current_line_part[:-2], self.line_type[-1], self.start_of_line))
+                self.line_type.append(StringReplacer.Comment)
+                self.current_line_part += line[pos-1:]
+                break
+
+            if self.current_line_part.lstrip() == '#':
+                self.add_line_part(StringReplacer(
+                    self.current_line_part[:-1], self.line_type[-1], self.start_of_line))
+                self.line_type.append(StringReplacer.Comment)
+                self.current_line_part += line[pos:]
+                break
+
+        last = self.current_line_part
+        if self.current_line_part.rstrip():
+            self.add_line_part(StringReplacer(self.current_line_part.rstrip(),
+                                              self.line_type[-1], self.start_of_line))
+        if last.endswith('\n'):
+            self.add_line_part(StringReplacer(self.current_line_part,
+                                              StringReplacer.EOL, self.start_of_line))
+
+class RegexLineSplitter(LineSplitter):
+    '''LineSplitter that finds the string and comment boundaries with a
+    precompiled pattern instead of inspecting the line character by
+    character. The line parts are the same as those of LineSplitter'''
+
+    tokens = re.compile(r'/\*|//|"')
+    directive = re.compile(r'\s*#')
+
+    def add_text(self, text, type):
+        '''Add text as a line part. Returns False if it only contained
+        whitespace, in which case it stays part of the next line part'''
+        if not text.strip():
+            return False
+
+        self.line_parts.append(StringReplacer(text, type, self.start_of_line))
+        self.start_of_line = False
+        return True
+
+    def parse_line(self, line):
+        line_type = self.line_type
+        if line_type[-1] == StringReplacer.Comment:
+            line_type.pop()
+
+        self.start_of_line = True
+
+        # start is where the current line part starts, pos is where we
+        # continue searching
+        start = 0
+        pos = 0
+        end = len(line)
+        while pos < end:
+            if line_type[-1] == StringReplacer.MultilineComment:
+                pos = line.find('*/', pos)
+                if pos < 0:
                     break
+                self.add_text(line[start:pos+2], line_type.pop())
+                start = pos = pos + 2
+                continue
 
-            last = self.current_line_part
-            if self.current_line_part.rstrip():
-                self.add_line_part(StringReplacer(self.current_line_part.rstrip(),
-                                                  self.line_type[-1], self.start_of_line))
-            if last.endswith('\n'):
-                self.add_line_part(StringReplacer(self.current_line_part,
-                                                  StringReplacer.EOL, self.start_of_line))
-        return self.line_parts
+            if self.directive.match(line, start):
+                line_type.append(StringReplacer.Comment)
+                break
+
+            match = self.tokens.search(line, pos)
+            if not match:
+                break
+
+            pos = match.start()
+            token = match.group()
+            if token == '"':
+                if line_type[-1] == StringReplacer.String:
+                    self.add_text(line[start:pos+1], line_type.pop())
+                else:
+                    self.add_text(line[start:pos+1], line_type[-1])
+                    line_type.append(StringReplacer.String)
+                start = pos = pos + 1
+                continue
 
+            if self.add_text(line[start:pos], line_type[-1]):
+                start = pos
+
+            if token == '//':
+                line_type.append(StringReplacer.Comment)
+                break
+
+            # The * that opens a multiline comment may also close it
+            line_type.append(StringReplacer.MultilineComment)
+            pos += 1
+
+        rest = line[start:]
+        if self.add_text(rest.rstrip(), line_type[-1]):
+            rest = ''
+        if line.endswith('\n'):
+            self.line_parts.append(StringReplacer(rest, StringReplacer.EOL,
+                                                  self.start_of_line))
+            self.start_of_line = False
 
 class Formatter(object):
+    # The StringReplacer methods that format normal line parts, in order
+    handlers = ['space_operators', 'handle_colon',
+                'handle_increment_and_decrement_operator', 'handle_indices',
+                'handle_keywords', 'handle_exponent', 'handle_pointers',
+                'handle_references', 'handle_unary', 'handle_comments',
+                'handle_start_of_statement', 'handle_brackets',
+                'handle_templates', 'handle_punctuation',
+                'handle_dereference', 'handle_includes']
+
+    # Characters of which at least one has to be in a line part for the
+    # handler to change it. The handlers only add and remove whitespace,
+    # so the other characters in a line part never change. Handlers that
+    # are not listed are always called
+    triggers = {
+        'space_operators': '!%&*+-/:<=>?^|',
+        'handle_colon': ':',
+        'handle_increment_and_decrement_operator': '+-',
+        'handle_indices': '!%&*+-/:<=>?^|',
+        'handle_keywords': 'fwr',
+        'handle_exponent': 'e',
+        'handle_pointers': '*',
+        'handle_references': '&',
+        'handle_unary': '+-&*',
+        'handle_comments': '/',
+        'handle_templates': '>',
+        'handle_punctuation': ',;.',
+        'handle_dereference': '-',
+        'handle_includes': '<',
+    }
+
+    # Number of formatted line parts that are remembered
+    max_formatted = 10000
+
     def __init__(self, text):
         self.text = text
         self.base_scope = None
         self.set_indent = False
         self.extra_newlines = False
+        self.splitter = RegexLineSplitter
+        self.instrumentation = None
         self.pos = 0
+        self.line = []
+
+        # Limits in seconds, characters per line and nested scopes, or None
+        self.timeout = None
+        self.max_line_length = None
+        self.max_depth = None
+
+        # Event that another thread can set to stop formatting, like a
+        # threading.Event, or None
+        self.cancelled = None
+
+        # Memo cache of the text of formatted normal line parts. The
+        # handlers only look at the text, the scope and the flags in the
+        # key, so a line part that occurs again is formatted by a single
+        # lookup. Line parts that occur once still go through all handlers
+        self.formatted = {}
+
+        self.handler_triggers = []
+        for handler in self.handlers:
+            trigger = self.triggers.get(handler)
+            if trigger is not None:
+                trigger = frozenset(trigger)
+            self.handler_triggers.append((handler, trigger))
 
     def handle_indentation(self, line_part):
         if self.set_indent:
@@ -577,116 +999,349 @@ class Formatter(object):
 
         new_text = str(line_part)
         if line_part.end_of_statement:
-            line_part.scope.alignment = {}
+            line_part.scope_state.alignment = {}
         else:
+            alignment = line_part.scope_state.alignment
             for item in line_part.alignments:
-                if item in new_text and item not in line_part.scope.alignment:
-                    line_part.scope.alignment[item] = self.pos + new_text.find(item)
+                if item in new_text and item not in alignment:
+                    alignment[item] = self.pos + new_text.find(item)
         self.pos += len(new_text)
 
-    def run(self):
-        splitter = LineSplitter(self.text)
-        line_parts = splitter.parse()
-
-        # Check that we popped all other self.line_types
-        # assert line_type == [StringReplacer.Normal]
-
-        set_scopes = ScopeSetter(line_parts, self.base_scope, self.extra_newlines)
-        set_scopes.parse()
-        line_parts = set_scopes.merge_equal_scopes()
+    def format_line_part(self, line_part):
+        '''Format a line part and return the resulting text'''
+        if line_part.type not in [StringReplacer.Normal]:
+            if self.set_indent and line_part.type not in [StringReplacer.MultilineComment]:
+                line_part.set_indentation()
+
+            return str(line_part)
+
+        if self.instrumentation is None:
+            key = (line_part.text, line_part.scope, line_part.start_of_line,
+                   line_part.start_of_statement, line_part.after_bracket)
+            text = self.formatted.get(key)
+            if text is None:
+                chars = set(line_part.text)
+                for handler, trigger in self.handler_triggers:
+                    if trigger is None or not trigger.isdisjoint(chars):
+                        getattr(line_part, handler)()
+
+                if len(self.formatted) >= self.max_formatted:
+                    self.formatted.clear()
+                self.formatted[key] = line_part.text
+            else:
+                line_part.text = text
+        else:
+            self.call_handlers(line_part, set(line_part.text))
+
+        self.handle_indentation(line_part)
+
+        return str(line_part)
+
+    def call_handlers(self, line_part, chars):
+        '''Call the handlers and let the instrumentation know when every
+        handler starts and ends, or is skipped, and whether it changed the
+        text. Handlers that set the text directly are counted as well'''
+        start = self.instrumentation.start
+        end = self.instrumentation.end
+        handled = self.instrumentation.handled
+        line_part.counter = self.instrumentation
+        for handler, trigger in self.handler_triggers:
+            if trigger is not None and trigger.isdisjoint(chars):
+                self.instrumentation.skipped(handler)
+                continue
 
-        text = ''
+            text = line_part.text
+            start(handler)
+            getattr(line_part, handler)()
+            end(handler, line_part)
+            handled(handler, line_part.text != text)
+
+    def instrument(self, iterator, stage):
+        '''Let the instrumentation know when the stage starts and ends
+        producing an item of iterator'''
+        start = self.instrumentation.start
+        end = self.instrumentation.end
+        iterator = iter(iterator)
+        while True:
+            start(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                end(stage, None)
+                return
+            end(stage, item)
+            yield item
+
+    def check_lines(self, lines):
+        '''Raise LimitExceeded when one of lines is too long'''
+        max_line_length = self.max_line_length
+        for number, line in enumerate(lines, 1):
+            if len(line) > max_line_length and \
+               len(line.rstrip('\r\n')) > max_line_length:
+                raise LimitExceeded('Line %d is longer than %d characters' %
+                                    (number, max_line_length))
+            yield line
+
+    def check_time(self, iterator, deadline):
+        '''Raise LimitExceeded when an item of iterator is produced after
+        deadline'''
+        for item in iterator:
+            if timer() > deadline:
+                raise LimitExceeded('Formatting took longer than %g seconds' %
+                                    self.timeout)
+            yield item
+
+    def check_cancelled(self, iterator):
+        '''Raise Cancelled when an item of iterator is produced after the
+        cancelled event is set'''
+        is_set = self.cancelled.is_set
+        for item in iterator:
+            if is_set():
+                raise Cancelled('Formatting was cancelled')
+            yield item
+
+    def run(self, sink=None):
+        '''Format the text. The formatted lines are written to sink as soon
+        as they are finished. This can be a list or any object with a write
+        method, like an open file or an io.StringIO. Without a sink, the
+        formatted text is returned'''
+        if sink is None:
+            return ''.join(self.iter_lines())
+
+        if isinstance(sink, list):
+            write = sink.append
+        else:
+            write = sink.write
+
+        for line in self.iter_lines():
+            write(line)
+
+    def iter_lines(self):
+        '''Generator version of run that yields every line as soon as it
+        is formatted. Only the line parts of which the scope may still
+        change are kept in memory, which is at most one statement'''
+        splitter = self.splitter(self.text)
+        if self.max_line_length is not None:
+            splitter.lines = self.check_lines(splitter.lines)
+        line_parts = splitter.iter_parse()
+        if self.instrumentation is not None:
+            line_parts = self.instrument(line_parts, 'split')
+        deadline = None
+        if self.timeout is not None:
+            deadline = timer() + self.timeout
+            line_parts = self.check_time(line_parts, deadline)
+        if self.cancelled is not None:
+            line_parts = self.check_cancelled(line_parts)
+
+        set_scopes = ScopeSetter(line_parts, self.base_scope,
+                                 self.extra_newlines)
+        set_scopes.max_depth = self.max_depth
+        set_scopes.cancelled = self.cancelled
+        set_scopes.deadline = deadline
+        set_scopes.timeout = self.timeout
+        line_parts = set_scopes.iter_parse()
+        if self.instrumentation is not None:
+            line_parts = self.instrument(line_parts, 'scopes')
+
+        line_parts = set_scopes.iter_merge_equal_scopes(line_parts)
+        if self.instrumentation is not None:
+            line_parts = self.instrument(line_parts, 'merge')
+        if self.timeout is not None:
+            line_parts = self.check_time(line_parts, deadline)
+        if self.cancelled is not None:
+            line_parts = self.check_cancelled(line_parts)
+
+        self.line = []
         self.pos = 0
+        for text in self.iter_format(line_parts):
+            yield text
+
+        text = ''.join(self.line).rstrip()
+        if text:
+            yield text
+
+    def iter_format(self, line_parts):
+        '''Format line parts and yield every line that is finished. The
+        text of the unfinished line is kept in self.line'''
+        line = self.line
+        instrumentation = self.instrumentation
         for line_part in line_parts:
-            if line_part.type not in [StringReplacer.Normal]:
-                if self.set_indent and line_part.type not in [StringReplacer.MultilineComment]:
-                    line_part.set_indentation()
+            if instrumentation is None:
+                text = self.format_line_part(line_part)
+            else:
+                instrumentation.start('format')
+                text = self.format_line_part(line_part)
+                instrumentation.end('format', line_part)
 
-                text += str(line_part)
+            if '\n' not in text:
+                line.append(text)
                 continue
 
-            # Put spaces around operators
-            ops = ['=', '+', '/', '-', '<', '>', '%', '*', '&', '|', '^', ':', '?',
-                   '<=', '>=', '==', '!=', '|=', '&=', '*=', '+=', '-=', '/=',
-                   '%=', '^=', '<<=', '>>=', '<<', '>>', '&&', '||', '//']
-            line_part.handle_operators(ops)
-
-            # Remove spaces around ::
-            line_part.replace(' : : ', '::')
-
-            line_part.handle_colon()
-
-            line_part.handle_increment_and_decrement_operator()
-
-            # Remove spaces in indices
-            if '[' in line_part.scope.last:
-                for op in ops:
-                    line_part.replace(' '+op+' ', op)
-
-            line_part.handle_keywords()
-
-            line_part.handle_exponent()
-
-            line_part.handle_pointers('*')
-            line_part.handle_pointers('&')
-
-            line_part.handle_unary(['+', '-', '&', '*'])
-
-            # Comments at the start of a line_part should stay there
-            line_part.regex_replace('^ //', '//')
-
-            if line_part.start_of_statement and not line_part.start_of_line:
-                line_part.regex_replace('^\s+', '')
-
-            line_part.handle_brackets()
-            line_part.handle_templates()
-            line_part.handle_punctuation()
-
-            # Pointer dereference ->
-            line_part.regex_replace('\s*\-\s*>\s*', '->')
-
-            # Includes should have a space
-            line_part.replace('include<', 'include <')
-
-            self.handle_indentation(line_part)
-
-            text += str(line_part)
-
-        # Remove spaces at the end of the lines
-        text = re.sub('[^\S\n]+$', '', text, flags=re.MULTILINE)
-
-        return text
-
-def reformat(text, base_scope=None, set_indent=False, extra_newlines=False):
+            # Remove spaces at the end of the lines
+            line.append(text)
+            lines = ''.join(line).split('\n')
+            for text in lines[:-1]:
+                yield text.rstrip() + '\n'
+            line[:] = [lines[-1]]
+
+def reformat(text, base_scope=None, set_indent=False, extra_newlines=False,
+             splitter=RegexLineSplitter, sink=None, instrumentation=None,
+             timeout=None, max_line_length=None, max_depth=None,
+             cancelled=None):
+    '''Format text. When formatting takes longer than timeout seconds, a
+    line is longer than max_line_length or scopes are nested deeper than
+    max_depth, LimitExceeded is raised. When the cancelled event, like a
+    threading.Event, is set by another thread, Cancelled is raised'''
     formatter = Formatter(text)
     formatter.base_scope = base_scope
     formatter.set_indent = set_indent
     formatter.extra_newlines = extra_newlines
-    return formatter.run()
+    formatter.splitter = splitter
+    formatter.instrumentation = instrumentation
+    formatter.timeout = timeout
+    formatter.max_line_length = max_line_length
+    formatter.max_depth = max_depth
+    formatter.cancelled = cancelled
+    return formatter.run(sink)
+
+def reformat_iter(lines, base_scope=None, set_indent=False,
+                  extra_newlines=False, splitter=RegexLineSplitter,
+                  instrumentation=None, timeout=None, max_line_length=None,
+                  max_depth=None, cancelled=None):
+    '''Reformat an iterable of lines, like an open file, and yield the
+    formatted lines as soon as they are finished'''
+    formatter = Formatter(lines)
+    formatter.base_scope = base_scope
+    formatter.set_indent = set_indent
+    formatter.extra_newlines = extra_newlines
+    formatter.splitter = splitter
+    formatter.instrumentation = instrumentation
+    formatter.timeout = timeout
+    formatter.max_line_length = max_line_length
+    formatter.max_depth = max_depth
+    formatter.cancelled = cancelled
+    return formatter.iter_lines()
+
+def read_lines(buffer, encoding=None):
+    '''Generator that reads the lines of a buffer of bytes, like an mmap,
+    one at a time. Newlines are translated like in files opened in text
+    mode. On Python 3 the lines are decoded with the encoding of such
+    files by default, on Python 2 they stay bytes unless an encoding is
+    given'''
+    decoder = None
+    if encoding is None and str is not bytes:
+        encoding = locale.getpreferredencoding(False)
+    if encoding is not None:
+        decoder = codecs.getincrementaldecoder(encoding)()
+
+    for line in iter(buffer.readline, b''):
+        if decoder is not None:
+            line = decoder.decode(line)
+        if not line:
+            continue
+        if '\r' not in line:
+            yield line
+            continue
+
+        line = line.replace('\r\n', '\n').replace('\r', '\n')
+        start = 0
+        while start < len(line):
+            end = line.find('\n', start) + 1 or len(line)
+            yield line[start:end]
+            start = end
+
+    if decoder is not None:
+        rest = decoder.decode(b'', True)
+        if rest:
+            yield rest
+
+def first_difference(text, base_scope=None, set_indent=False,
+                     extra_newlines=False, splitter=RegexLineSplitter,
+                     timeout=None, max_line_length=None, max_depth=None):
+    '''Returns the number of the first line, starting at 1, that changes
+    when text is formatted, or 0 if it is formatted already. Formatting
+    stops at the first line that changes'''
+    lines = text
+    if isinstance(text, str):
+        lines = text.splitlines(True)
+
+    number = 0
+    for number, line in enumerate(reformat_iter(
+            lines, base_scope, set_indent, extra_newlines, splitter, None,
+            timeout, max_line_length, max_depth), 1):
+        if number > len(lines) or line != lines[number-1]:
+            return number
+
+    if number < len(lines):
+        return number + 1
+    return 0
 
 def main():
     if len(sys.argv) < 2:
         print('No filename')
         return
 
+    if len(sys.argv) > 2 or sys.argv[1].startswith('-') or \
+       os.path.isdir(sys.argv[1]):
+        from .batch import main as batch_main
+        sys.exit(batch_main(sys.argv[1:]))
+
     fname = sys.argv[1]
     if not os.path.exists(fname):
         print(fname, 'is not a valid filename')
-
-    f = open(fname, 'r')
-    lines = f.readlines()
-    f.close()
+        return
 
     if not os.path.exists(fname+'.bak'):
-        f = open(fname+'.bak', 'w')
-        f.write(''.join(lines))
+        shutil.copyfile(fname, fname+'.bak')
+
+    # The formatted text is written to a temporary file that replaces the
+    # original when it is done, so the input can stay mapped until then
+    # and a failure leaves the original untouched. It replaces the file
+    # that a symlink points to, so the link stays
+    fname = os.path.realpath(fname)
+    tmpname = None
+    if os.stat(fname).st_nlink == 1:
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(fname),
+                                           prefix='.' + os.path.basename(fname))
+        except (IOError, OSError):
+            pass
+
+    # Replacing a file with hard links would split it from them, and the
+    # directory may not be writable, so then it is written in place
+    if tmpname is None:
+        f = open(fname, 'r')
+        text = reformat(f.read(), set_indent=True, extra_newlines=True)
+        f.close()
+        f = open(fname, 'w')
+        f.write(text)
         f.close()
+        return
 
-    text = reformat(lines, set_indent=True, extra_newlines=True)
+    out = os.fdopen(fd, 'w')
+    f = open(fname, 'rb')
+    buffer = None
+    try:
+        lines = []
+        if os.fstat(f.fileno()).st_size:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            lines = read_lines(buffer)
+        reformat(lines, set_indent=True, extra_newlines=True, sink=out)
+        out.close()
+        shutil.copymode(fname, tmpname)
+    except:
+        out.close()
+        os.remove(tmpname)
+        raise
+    finally:
+        if buffer is not None:
+            buffer.close()
+        f.close()
 
-    f = open(fname, 'w')
-    f.write(text)
-    f.close()
+    if hasattr(os, 'replace'):
+        os.replace(tmpname, fname)
+    else:
+        os.rename(tmpname, fname)
 
 if __name__ == "__main__":
     main()
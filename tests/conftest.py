@@ -0,0 +1,7 @@
+import sys
+
+# The asyncio interface needs Python 3.7, and its tests do not even
+# compile on Python 2
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_aio.py')
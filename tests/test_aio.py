@@ -0,0 +1,73 @@
+import time
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from reformat import reformat
+from reformat.aio import AsyncFormatter, reformat_async
+
+code = 'int a=b;\nif (a<b)\n{\nf(a,b);\n}\n' * 200
+
+def test_reformat_async():
+    expected = reformat(code, set_indent=True)
+    assert asyncio.run(reformat_async(code, set_indent=True)) == expected
+
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    try:
+        assert asyncio.run(reformat_async(code, set_indent=True,
+                                          executor=executor)) == expected
+    finally:
+        executor.shutdown()
+
+def test_superseded():
+    formatter = AsyncFormatter()
+
+    async def main():
+        old = asyncio.ensure_future(formatter.format(code, 'buffer'))
+        await asyncio.sleep(0)
+        new = await formatter.format(code.replace('a<b', 'a>b'), 'buffer')
+        with pytest.raises(asyncio.CancelledError):
+            await old
+        return new
+
+    assert asyncio.run(main()) == reformat(code.replace('a<b', 'a>b'))
+    assert formatter.tasks == {}
+
+def test_fair():
+    formatter = AsyncFormatter()
+    done = []
+
+    async def format(text, name):
+        await formatter.format(text, name)
+        done.append(name)
+
+    async def main():
+        await asyncio.gather(format(code * 5, 'large'),
+                             format(code[:100], 'small'))
+
+    asyncio.run(main())
+    assert done == ['small', 'large']
+
+def test_minified():
+    # The stale request stops in the middle of its single line, so the
+    # only thread is free for the new one
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    formatter = AsyncFormatter(executor)
+    minified = 'int a=b;if (a<b){f(a,b);}' * 20000 + '\n'
+
+    async def main():
+        old = asyncio.ensure_future(formatter.format(minified, 'buffer'))
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        new = await formatter.format(code, 'buffer')
+        with pytest.raises(asyncio.CancelledError):
+            await old
+        return new, time.monotonic() - start
+
+    try:
+        new, elapsed = asyncio.run(main())
+    finally:
+        executor.shutdown()
+    assert new == reformat(code)
+    assert elapsed < 2
@@ -0,0 +1,109 @@
+import os
+import io
+from reformat import batch
+from reformat.cache import Cache, CANONICAL
+
+def write(path, text):
+    f = open(str(path), 'w')
+    f.write(text)
+    f.close()
+
+def read(path):
+    f = open(str(path), 'r')
+    text = f.read()
+    f.close()
+    return text
+
+def test_find_files(tmpdir):
+    write(tmpdir.join('small.cpp'), 'a=b;\n')
+    write(tmpdir.join('large.hpp'), 'a=b;\n' * 10)
+    write(tmpdir.join('notes.txt'), 'a=b;\n')
+    write(tmpdir.join('old.cpp.bak'), 'a=b;\n')
+    tmpdir.mkdir('.git')
+    write(tmpdir.join('.git', 'hidden.cpp'), 'a=b;\n')
+    tmpdir.mkdir('build')
+    write(tmpdir.join('build', 'gen.cpp'), 'a=b;\n' * 5)
+
+    files = batch.find_files([str(tmpdir)])
+    assert [os.path.basename(f) for f in files] == ['large.hpp', 'gen.cpp', 'small.cpp']
+
+    files = batch.find_files([str(tmpdir)], ignore=batch.ignore + ['build'])
+    assert [os.path.basename(f) for f in files] == ['large.hpp', 'small.cpp']
+
+    files = batch.find_files([str(tmpdir.join('notes.txt'))])
+    assert [os.path.basename(f) for f in files] == ['notes.txt']
+
+def test_run(tmpdir):
+    write(tmpdir.join('a.cpp'), 'a=b;\n')
+    write(tmpdir.join('b.cpp'), 'a = b;\n')
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    errors = batch.run([str(tmpdir)], jobs=1, out=out)
+    assert errors == 0
+    assert read(tmpdir.join('a.cpp')) == 'a = b;\n'
+    assert read(tmpdir.join('a.cpp.bak')) == 'a=b;\n'
+    assert not tmpdir.join('b.cpp.bak').check()
+    assert sorted(out.getvalue().splitlines()) == [
+        str(tmpdir.join('a.cpp')) + ': formatted',
+        str(tmpdir.join('b.cpp')) + ': unchanged']
+
+def test_run_pool(tmpdir):
+    for i in range(4):
+        write(tmpdir.join('%d.cpp' % i), 'a=b;\n' * (i + 1))
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    assert batch.run([str(tmpdir)], jobs=2, backup=False, out=out) == 0
+    for i in range(4):
+        assert read(tmpdir.join('%d.cpp' % i)) == 'a = b;\n' * (i + 1)
+        assert not tmpdir.join('%d.cpp.bak' % i).check()
+
+def test_run_cache(tmpdir):
+    src = tmpdir.mkdir('src')
+    write(src.join('a.cpp'), 'a = b;\n')
+    cache = Cache(str(tmpdir.join('cache')))
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    assert batch.run([str(src)], jobs=1, out=out, cache=cache) == 0
+    key = cache.key('a = b;\n', set_indent=True, extra_newlines=True)
+    assert cache.get(key) == CANONICAL
+
+    # A file that is formatted is skipped in the next run
+    write(src.join('b.cpp'), 'c=d;\n')
+    assert batch.run([str(src)], jobs=1, out=out, cache=cache) == 0
+    key = cache.key('c = d;\n', set_indent=True, extra_newlines=True)
+    assert cache.get(key) == CANONICAL
+
+def test_run_check(tmpdir):
+    write(tmpdir.join('a.cpp'), 'a = b;\nc=d;\n')
+    write(tmpdir.join('b.cpp'), 'a = b;\n')
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    assert batch.run([str(tmpdir)], jobs=1, out=out, check=True) == 1
+    assert read(tmpdir.join('a.cpp')) == 'a = b;\nc=d;\n'
+    assert not tmpdir.join('a.cpp.bak').check()
+    assert sorted(out.getvalue().splitlines()) == [
+        str(tmpdir.join('a.cpp')) + ':2: not formatted',
+        str(tmpdir.join('b.cpp')) + ': formatted']
+
+def test_run_split(tmpdir):
+    write(tmpdir.join('large.cpp'), 'int a=b;\n' * 20)
+    write(tmpdir.join('small.cpp'), 'a=b;\n')
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    assert batch.run([str(tmpdir)], jobs=2, backup=False, out=out,
+                     split=10) == 0
+    assert read(tmpdir.join('large.cpp')) == 'int a = b;\n' * 20
+    assert read(tmpdir.join('small.cpp')) == 'a = b;\n'
+
+def test_run_limits(tmpdir):
+    write(tmpdir.join('a.cpp'), 'a=b;\n')
+    write(tmpdir.join('b.cpp'), 'a=b;\n' + 'f(\n' * 20 + ')' * 20 + ';\n')
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    assert batch.run([str(tmpdir)], jobs=1, backup=False, out=out,
+                     limits={'max_depth': 10}) == 0
+    assert read(tmpdir.join('a.cpp')) == 'a = b;\n'
+    assert read(tmpdir.join('b.cpp')).startswith('a=b;\n')
+    assert sorted(out.getvalue().splitlines()) == [
+        str(tmpdir.join('a.cpp')) + ': formatted',
+        str(tmpdir.join('b.cpp')) + ': skipped: Scopes are nested deeper than 10']
@@ -0,0 +1,40 @@
+import os
+from reformat.cache import Cache, CANONICAL
+
+def test_key():
+    cache = Cache('unused')
+    key = cache.key('a = b;\n')
+    assert key == cache.key('a = b;\n')
+    assert key != cache.key('a = b;\n', set_indent=True)
+    assert key != cache.key('a = b;\n', extra_newlines=True)
+    assert key != cache.key('a = b;\n', base_scope=1)
+    assert key != cache.key('a=b;\n')
+
+def test_get_put(tmpdir):
+    cache = Cache(str(tmpdir))
+    key = cache.key('a = b;\n')
+    assert cache.get(key) is None
+    cache.put(key, CANONICAL)
+    assert cache.get(key) == CANONICAL
+    assert Cache(str(tmpdir)).get(key) == CANONICAL
+
+def test_evict(tmpdir):
+    cache = Cache(str(tmpdir), max_entries=2)
+    keys = [cache.key(str(i)) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, CANONICAL)
+        os.utime(cache.filename(key), (i, i))
+
+    assert cache.evict() == 2
+    assert [cache.get(key) for key in keys] == [None, None, CANONICAL, CANONICAL]
+
+def test_pickle(tmpdir, monkeypatch):
+    import pickle
+    cache = Cache(str(tmpdir))
+    key = cache.key('a = b;\n')
+
+    # Pool workers that are spawned unpickle the cache in a new process
+    # where the version was never computed
+    data = pickle.dumps(cache)
+    monkeypatch.setattr(Cache, 'version', None)
+    assert pickle.loads(data).key('a = b;\n') == key
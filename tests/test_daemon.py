@@ -0,0 +1,72 @@
+import io
+import os
+import json
+
+import pytest
+
+from reformat import daemon as daemon_module
+from reformat.daemon import Daemon
+
+def test_handle():
+    daemon = Daemon()
+    assert daemon.handle({'text': 'a=b;\n'}) == {'text': 'a = b;\n'}
+    assert daemon.handle({'lines': ['a=b;\n', 'c=d;\n']}) == {'text': 'a = b;\nc = d;\n'}
+
+def test_handle_range():
+    daemon = Daemon()
+    request = {'text': 'a=b;\nc=d;\n', 'buffer': 'test.cpp', 'start': 1}
+    assert daemon.handle(request) == {'text': 'c = d;\n', 'start': 1, 'end': 2}
+    assert 'test.cpp' in daemon.buffers
+
+def test_serve():
+    requests = [json.dumps({'text': 'a=b;'}), '', '{', json.dumps({})]
+    rfile = io.BytesIO(('\n'.join(requests) + '\n').encode('utf-8'))
+    wfile = io.BytesIO()
+    Daemon().serve(rfile, wfile)
+
+    responses = [json.loads(line) for line in wfile.getvalue().decode('utf-8').splitlines()]
+    assert len(responses) == 3
+    assert responses[0] == {'text': 'a = b;'}
+    assert 'error' in responses[1]
+    assert responses[2] == {'error': 'ValueError: No text in request'}
+
+def test_handle_limits():
+    daemon = Daemon()
+    request = {'text': 'a=b;\nc=d;\n', 'max_line_length': 3}
+    assert daemon.handle_line(json.dumps(request)) == json.dumps(
+        {'error': 'LimitExceeded: Line 1 is longer than 3 characters'}) + '\n'
+
+    request.update({'buffer': 'test.cpp', 'start': 1})
+    assert 'LimitExceeded' in json.loads(daemon.handle_line(json.dumps(request)))['error']
+
+def test_buffers():
+    daemon = Daemon()
+    daemon.max_buffers = 2
+    for name in ['a.cpp', 'b.cpp', 'a.cpp', 'c.cpp']:
+        daemon.handle({'text': 'a=b;\n', 'buffer': name, 'start': 0})
+    assert list(daemon.buffers) == ['a.cpp', 'c.cpp']
+
+    assert daemon.handle({'buffer': 'a.cpp', 'close': True}) == {}
+    assert list(daemon.buffers) == ['c.cpp']
+
+def test_private_dir(tmpdir, monkeypatch):
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr(daemon_module.tempfile, 'gettempdir',
+                        lambda: str(tmpdir))
+    path = daemon_module.default_path()
+    assert os.path.dirname(os.path.dirname(path)) == str(tmpdir)
+
+    daemon_module.make_private_dir(os.path.dirname(path))
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+
+    shared = tmpdir.mkdir('shared')
+    shared.chmod(0o755)
+    with pytest.raises(IOError):
+        daemon_module.make_private_dir(str(shared))
+
+    if hasattr(os, 'getuid') and os.getuid() == 0:
+        sock = tmpdir.join('other.sock')
+        sock.write('')
+        os.chown(str(sock), 12345, -1)
+        with pytest.raises(IOError):
+            daemon_module.request({'text': 'a=b;'}, str(sock))
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+from reformat import gitdiff
+
+def write(path, text):
+    f = open(str(path), 'w')
+    f.write(text)
+    f.close()
+
+def read(path):
+    f = open(str(path), 'r')
+    text = f.read()
+    f.close()
+    return text
+
+@pytest.fixture
+def repo(tmpdir, monkeypatch):
+    try:
+        gitdiff.git(['--version'])
+    except OSError:
+        pytest.skip('git is not installed')
+
+    for name in ['AUTHOR', 'COMMITTER']:
+        monkeypatch.setenv('GIT_%s_NAME' % name, 'test')
+        monkeypatch.setenv('GIT_%s_EMAIL' % name, 'test@example.com')
+    monkeypatch.chdir(tmpdir)
+
+    gitdiff.git(['init', '-q'])
+    write(tmpdir.join('a.cpp'), 'int a=b;\nint c=d;\nint e=f;\n')
+    write(tmpdir.join('b.cpp'), 'int a=b;\n')
+    write(tmpdir.join('notes.txt'), 'a=b;\n')
+    gitdiff.git(['add', '.'])
+    gitdiff.git(['commit', '-q', '-m', 'Initial'])
+    return tmpdir
+
+def test_changed_files(repo):
+    assert gitdiff.changed_files() == []
+
+    write(repo.join('a.cpp'), 'int a=b;\nint c=d+1;\nint e=f;\n')
+    write(repo.join('notes.txt'), 'a=c;\n')
+    assert gitdiff.changed_files() == [str(repo.join('a.cpp'))]
+    assert gitdiff.changed_files(staged=True) == []
+    assert gitdiff.changed_lines(str(repo.join('a.cpp'))) == [(1, 2)]
+
+    write(repo.join('a.cpp'), 'int a=b;\nint e=f;\n')
+    assert gitdiff.changed_lines(str(repo.join('a.cpp'))) == [(1, 2)]
+
+def test_run_lines(repo):
+    write(repo.join('a.cpp'), 'int a=b;\nint c=d+1;\nint e=f;\n')
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    assert gitdiff.run(lines=True, check=True, out=out) == 1
+    assert out.getvalue() == str(repo.join('a.cpp')) + ': not formatted\n'
+
+    assert gitdiff.run(lines=True, backup=False, out=out) == 0
+    assert read(repo.join('a.cpp')) == 'int a=b;\nint c = d + 1;\nint e=f;\n'
+    assert read(repo.join('b.cpp')) == 'int a=b;\n'
+
+def test_run_staged(repo):
+    write(repo.join('a.cpp'), 'int a=b;\nint c=d+1;\nint e=f;\n')
+    write(repo.join('b.cpp'), 'int a=b+1;\n')
+    gitdiff.git(['add', 'a.cpp', 'b.cpp'])
+    write(repo.join('b.cpp'), 'int a=b+2;\n')
+
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    assert gitdiff.run(staged=True, out=out) == 0
+    assert gitdiff.git(['show', ':a.cpp']).decode('ascii') == \
+        'int a = b;\nint c = d + 1;\nint e = f;\n'
+    assert read(repo.join('a.cpp')) == 'int a = b;\nint c = d + 1;\nint e = f;\n'
+
+    # Changes that are not staged are kept
+    assert gitdiff.git(['show', ':b.cpp']).decode('ascii') == 'int a = b + 1;\n'
+    assert read(repo.join('b.cpp')) == 'int a=b+2;\n'
+
+def test_read_staged(repo):
+    repo.join('c.cpp').write_binary(b'int a=b;\r\nint c=d;\r\n')
+    gitdiff.git(['add', 'c.cpp'])
+
+    # The same type and newlines as the text of a file in the working tree
+    text, mode = gitdiff.read_staged(str(repo.join('c.cpp')))
+    assert isinstance(text, str)
+    assert (text, mode) == ('int a=b;\nint c=d;\n', '100644')
+
+    gitdiff.write_staged(str(repo.join('c.cpp')), 'int a = b;\n', mode)
+    assert gitdiff.git(['show', ':c.cpp']) == b'int a = b;\n'
@@ -0,0 +1,46 @@
+from reformat import reformat
+from reformat.incremental import IncrementalFormatter
+
+code = '''int a=b;
+std::map<int,
+    int> m;
+if (a<b)
+{
+    f(a,b);
+}
+int c=d;
+'''
+
+def test_format_range():
+    formatter = IncrementalFormatter(code, interval=1)
+    assert formatter.format_range(0, 1) == (0, 1, 'int a = b;\n')
+    assert formatter.format_range(2, 3) == (1, 3, 'std::map<int,\n    int> m;\n')
+    assert formatter.format_range(7, 8) == (7, 8, 'int c = d;\n')
+
+def test_format_range_full():
+    formatter = IncrementalFormatter(code, interval=2)
+    formatter.set_indent = True
+    formatter.extra_newlines = True
+    first, last, text = formatter.format_range(0, 8)
+    assert (first, last) == (0, 8)
+    assert text == reformat(code, set_indent=True, extra_newlines=True)
+
+def test_update():
+    formatter = IncrementalFormatter(code, interval=1)
+    formatter.format_range(7, 8)
+    assert len(formatter.numbers) > 1
+
+    formatter.update(code.replace('int c=d;', 'int c=d+e;'))
+    assert formatter.format_range(7, 8) == (7, 8, 'int c = d + e;\n')
+
+    formatter.update(code.replace('int a=b;', 'int a[2]={1,2};'))
+    assert formatter.numbers == [0]
+
+def test_format_ranges():
+    formatter = IncrementalFormatter(code, interval=1)
+    assert formatter.format_ranges([(7, 8), (2, 3)]) == \
+        code.replace('int c=d;', 'int c = d;')
+    assert formatter.format_ranges([(4, 6), (5, 7)]) == \
+        code.replace('f(a,b);', 'f(a, b);')
+    assert formatter.format_ranges([(0, 8)]) == reformat(code)
+    assert formatter.format_ranges([(8, 9)]) == code
@@ -0,0 +1,80 @@
+from reformat import reformat
+from reformat.reformat import Formatter
+from reformat.instrumentation import Instrumentation, Collector
+
+class Recorder(Instrumentation):
+    def __init__(self):
+        self.calls = []
+
+    def start(self, name):
+        self.calls.append(('start', name))
+
+    def end(self, name, line_part):
+        self.calls.append(('end', name))
+
+    def skipped(self, name):
+        self.calls.append(('skipped', name))
+
+def test_callbacks():
+    recorder = Recorder()
+    assert reformat('a=b;\n', instrumentation=recorder) == 'a = b;\n'
+
+    starts = [name for call, name in recorder.calls if call == 'start']
+    ends = [name for call, name in recorder.calls if call == 'end']
+    skipped = [name for call, name in recorder.calls if call == 'skipped']
+    assert sorted(starts) == sorted(ends)
+    for name in ['split', 'scopes', 'merge', 'format'] + Formatter.handlers:
+        assert name in starts or name in skipped
+
+def test_collector():
+    collector = Collector()
+    code = 'int a=b;\nif (a<b)\n{\n    f(a,b);\n}\n'
+    assert reformat(code, instrumentation=collector) == reformat(code)
+
+    summary = collector.summary()
+    assert summary['split']['count'] == 10
+    assert summary['format']['count'] == summary['merge']['count']
+    assert summary['space_operators']['count'] + \
+        summary['space_operators']['skipped'] == 8
+    for item in summary.values():
+        assert 0 <= item['self'] <= item['time']
+    assert 'space_operators' in collector.report()
+
+def test_replacements():
+    collector = Collector()
+    reformat('x = 1.5e - 3;\nf(a<b);\n', instrumentation=collector)
+
+    invoked, changed, elapsed = collector.replacements[
+        ('handle_includes', 'include<')]
+    assert invoked == collector.summary()['handle_includes']['count']
+    assert changed == 0
+
+    exponents = [counts for (handler, search), counts in
+                 collector.replacements.items() if handler == 'handle_exponent']
+    assert sum(changed for invoked, changed, elapsed in exponents) == 1
+    assert 'never changed' in collector.replacement_report()
+
+def test_skipped():
+    collector = Collector()
+    reformat('a=b;\nc;\n', instrumentation=collector)
+
+    summary = collector.summary()
+    assert summary['space_operators'] == dict(summary['space_operators'], count=1, skipped=1)
+    assert summary['handle_exponent']['count'] == 0
+    assert summary['handle_exponent']['skipped'] == 2
+    assert summary['handle_brackets']['skipped'] == 0
+
+def test_handled():
+    collector = Collector()
+    reformat('a=b;\nc;\nint *p;\n', instrumentation=collector)
+
+    # These handlers set the text without replace or regex_replace
+    summary = collector.summary()
+    assert summary['space_operators']['changed'] == 2
+    assert summary['handle_pointers']['changed'] == 1
+    assert summary['handle_exponent']['changed'] == 0
+    assert not any(handler == 'space_operators'
+                   for handler, search in collector.replacements)
+
+    report = collector.replacement_report()
+    assert "space_operators                          '*'" in report
@@ -0,0 +1,71 @@
+import multiprocessing
+
+from reformat import reformat, reformat_parallel
+from reformat.parallel import split_points, format_chunk
+from reformat.Scope import Scope
+
+text = '''namespace a {
+int f(int x){
+return x<<1;
+}
+}
+std::cout<<f(1)<<std::endl;
+int b=f(2);
+class A {
+public:
+int g(int y,
+int z);
+};
+template<class T> T h(T t){return t;}
+'''
+
+def test_split_points():
+    lines = ['a;\n', 'b;\n', '  c;\n', 'd;\n', 'e;\n', 'f;\n', 'g;\n', 'h;\n']
+    assert split_points(lines, 2) == [4]
+    assert split_points(lines, 4) == [4, 6]
+    lines[4] = '// e\n'
+    assert split_points(lines, 2) == []
+
+def test_format_chunk():
+    lines = text.splitlines(True)
+    start = (Scope(None), (None,), False)
+    chunk, end, clean = format_chunk((lines[:10], start, False, False, False))
+    assert not clean
+
+    # The states of the removed << are copies of the global scope
+    chunk, end, clean = format_chunk((lines[:6], start, False, False, False))
+    assert clean
+    assert end == (Scope(None), ('free',), False)
+    rest = format_chunk((lines[6:], end, False, False, True))[0]
+    assert chunk + rest == reformat(text)
+
+def test_reformat_parallel():
+    pool = multiprocessing.Pool(2)
+    try:
+        for base_scope in [None, 1]:
+            for set_indent in [False, True]:
+                for extra_newlines in [False, True]:
+                    expected = reformat(text * 5, base_scope, set_indent,
+                                        extra_newlines)
+                    assert reformat_parallel(text * 5, base_scope,
+                                             set_indent, extra_newlines,
+                                             jobs=4, pool=pool,
+                                             min_lines=0) == expected
+    finally:
+        pool.close()
+        pool.join()
+
+    assert reformat_parallel(text, jobs=1) == reformat(text)
+
+def test_format_chunk_extra_newline():
+    text = 'namespace a {\n/* b */ int c;\n/* d */ int e;\n}\n'
+    lines = text.splitlines(True)
+    expected = reformat(text, extra_newlines=True)
+    # A new line is added after the comments, because they follow { and ;
+    for number in [1, 2]:
+        chunk, end, clean = format_chunk(
+            (lines[:number], (Scope(None), (None,), False), False, True,
+             False))
+        assert clean and end[2]
+        rest = format_chunk((lines[number:], end, False, True, True))[0]
+        assert chunk + rest == expected
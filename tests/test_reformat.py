@@ -620,3 +620,182 @@ int b = 2;
 int c(a * b);'''
     out = reformat.reformat(code)
     assert out == code
+
+def test_regex_line_splitter():
+    from reformat.reformat import LineSplitter, RegexLineSplitter
+    code = '''#include <iostream>
+  # define A "a" // b
+a = "b // c" + "/* d */"; // e
+f(/* g */ "h", "i#j") /*/ k
+l */ m;
+"n /* o
+*/ p";
+'''
+    def parts(splitter):
+        return [(line_part.type, line_part.text, line_part.start_of_line)
+                for line_part in splitter(code).parse()]
+    assert parts(RegexLineSplitter) == parts(LineSplitter)
+    out = reformat.reformat(code, splitter=LineSplitter)
+    assert reformat.reformat(code) == out
+
+def test_space_operators():
+    from reformat.reformat import StringReplacer
+    for code in ['a<<=b', 'a  ::b', 'a!=b', 'a===b', 'a   +  b', 'x->y',
+                 'a>>>=b', 'std::cout<<*a', 'a ? b : c', 'a! =b']:
+        expected = StringReplacer(code, StringReplacer.Normal)
+        expected.handle_operators(list(StringReplacer.operators))
+        expected.replace(' : : ', '::')
+        line_part = StringReplacer(code, StringReplacer.Normal)
+        line_part.space_operators()
+        assert line_part.text == expected.text
+
+def test_reformat_iter():
+    code = '''namespace A {
+void f(int *a)
+{
+    g(a*b);  
+}
+}
+int c<d;
+'''
+    out = reformat.reformat(code, set_indent=True, extra_newlines=True)
+    lines = reformat.reformat_iter(code.splitlines(True), set_indent=True,
+                                   extra_newlines=True)
+    assert ''.join(lines) == out
+
+    # Lines are yielded before the rest of the input is read
+    read = []
+    def lines():
+        for i in range(1000):
+            read.append(i)
+            yield 'a=b+c;\n'
+    lines = reformat.reformat_iter(lines())
+    assert next(lines) == 'a = b + c;\n'
+    assert len(read) < 10
+
+def test_sink():
+    import io
+    code = 'a=b;  \nc=d;\n'
+    sink = []
+    assert reformat.reformat(code, sink=sink) is None
+    assert sink == ['a = b;\n', 'c = d;\n']
+    sink = io.StringIO() if str is not bytes else io.BytesIO()
+    reformat.reformat(code, sink=sink)
+    assert sink.getvalue() == 'a = b;\nc = d;\n'
+
+def test_first_difference():
+    assert reformat.first_difference('a = b;\nc = d;\n') == 0
+    assert reformat.first_difference('a = b;\nc=d;\ne=f;\n') == 2
+    assert reformat.first_difference('a = b;\n\n  \n') == 3
+    assert reformat.first_difference('a = b; c = d;\n', extra_newlines=True) == 1
+
+def test_formatted_line_parts():
+    # The same text is formatted differently in another scope
+    code = 'a: b;\nclass A {\na: b;\n};\na: b;\n'
+    assert reformat.reformat(code) == 'a : b;\nclass A {\na: b;\n};\na : b;\n'
+
+    from reformat.reformat import Formatter
+    formatter = Formatter('a=b;\na=b;\n')
+    assert ''.join(formatter.iter_lines()) == 'a = b;\na = b;\n'
+    assert list(formatter.formatted.values()) == ['a = b; ']
+
+def test_read_lines():
+    import io
+    from reformat.reformat import read_lines
+    buffer = io.BytesIO(b'a=b;\r\nc=d;\re=f;\n\xc3\xa9\x0cg')
+    lines = list(read_lines(buffer, 'utf-8'))
+    assert lines == ['a=b;\n', 'c=d;\n', 'e=f;\n', u'\xe9\x0cg']
+    assert list(read_lines(io.BytesIO(b''))) == []
+
+def test_main(tmpdir, monkeypatch):
+    import sys
+    from reformat.reformat import main
+    fname = tmpdir.join('a.cpp')
+    fname.write_binary(b'int a=b;\r\nint c=d;\n')
+    monkeypatch.setattr(sys, 'argv', ['reformat', str(fname)])
+    main()
+    assert fname.read_binary() == b'int a = b;\nint c = d;\n'
+    assert tmpdir.join('a.cpp.bak').read_binary() == b'int a=b;\r\nint c=d;\n'
+    assert sorted(tmpdir.listdir()) == [fname, tmpdir.join('a.cpp.bak')]
+
+    fname.write_binary(u'int a=b; // caf\xe9\n'.encode('utf-8'))
+    main()
+    assert fname.read_binary() == u'int a = b; // caf\xe9\n'.encode('utf-8')
+
+def test_main_links(tmpdir, monkeypatch):
+    import os
+    import sys
+    from reformat.reformat import main
+    if not hasattr(os, 'symlink') or not hasattr(os, 'link'):
+        pytest.skip('no links')
+
+    fname = tmpdir.join('a.cpp')
+    fname.write_binary(b'int a=b;\n')
+    link = tmpdir.join('link.cpp')
+    link.mksymlinkto(fname)
+    monkeypatch.setattr(sys, 'argv', ['reformat', str(link)])
+    main()
+    assert link.islink()
+    assert fname.read_binary() == b'int a = b;\n'
+
+    os.link(str(fname), str(tmpdir.join('b.cpp')))
+    fname.write_binary(b'int c=d;\n')
+    monkeypatch.setattr(sys, 'argv', ['reformat', str(fname)])
+    main()
+    assert tmpdir.join('b.cpp').read_binary() == b'int c = d;\n'
+
+def test_cancelled():
+    import threading
+    cancelled = threading.Event()
+    assert reformat.reformat('a=b;\n', cancelled=cancelled) == 'a = b;\n'
+
+    cancelled.set()
+    with pytest.raises(reformat.Cancelled):
+        reformat.reformat('a=b;\n', cancelled=cancelled)
+
+    # Also in the middle of a single line part
+    from reformat.reformat import ScopeSetter, StringReplacer
+    set_scopes = ScopeSetter([StringReplacer('a=b;' * 10,
+                                             StringReplacer.Normal)])
+    set_scopes.cancelled = cancelled
+    with pytest.raises(reformat.Cancelled):
+        set_scopes.parse()
+
+def test_limits():
+    text = 'a=b;\n' + 'f(\n' * 50
+    assert reformat.reformat(text, max_depth=50, max_line_length=4) == \
+        reformat.reformat(text)
+
+    with pytest.raises(reformat.LimitExceeded) as info:
+        reformat.reformat(text, max_depth=10)
+    assert info.value.reason == 'Scopes are nested deeper than 10'
+
+    with pytest.raises(reformat.LimitExceeded) as info:
+        reformat.reformat(text, max_line_length=3)
+    assert info.value.reason == 'Line 1 is longer than 3 characters'
+
+    with pytest.raises(reformat.LimitExceeded) as info:
+        reformat.reformat(text, timeout=-1)
+    assert info.value.reason == 'Formatting took longer than -1 seconds'
+
+    with pytest.raises(reformat.LimitExceeded):
+        reformat.first_difference('a = b;\n' + 'f(\n' * 50, max_depth=10)
+
+def test_timeout_long_line():
+    # The timeout stops a single long line while its scopes are set
+    import time
+    from reformat.incremental import IncrementalFormatter
+    line = 'int a=b;if (a<b){f(a,b);}' * 8000 + '\n'
+
+    start = time.time()
+    with pytest.raises(reformat.LimitExceeded) as info:
+        reformat.reformat(line, timeout=0.1)
+    assert info.value.reason == 'Formatting took longer than 0.1 seconds'
+    assert time.time() - start < 2
+
+    formatter = IncrementalFormatter(line)
+    formatter.timeout = 0.1
+    start = time.time()
+    with pytest.raises(reformat.LimitExceeded):
+        formatter.format_range(0, 1)
+    assert time.time() - start < 2
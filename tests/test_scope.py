@@ -1,8 +1,42 @@
 import pytest
 from reformat import Scope
+from reformat.Scope import ScopeState
 
 def test_last():
     scope = Scope(1)
     scope = Scope(scope, '(')
     scope = Scope(scope, 'last')
     assert scope.last == 'last'
+
+def test_counts():
+    scope = Scope(2)
+    scope = Scope(scope, 'class')
+    scope = Scope(scope, '<')
+    assert len(scope) == 4
+    assert 'class' in scope
+    assert 'initializer list' not in scope
+    assert not scope.is_global()
+    assert scope.indented_scopes() == 2
+    assert list(scope) == ['<', 'class', '{', '{']
+
+def test_interned():
+    scope = Scope(Scope(1), '(')
+    assert scope is Scope(Scope(1), '(')
+    assert scope == Scope(Scope(1), '(')
+    assert scope != Scope(Scope(1), '[')
+    assert scope.parent is Scope(1)
+    assert Scope(None) is Scope(0) is Scope.root
+    assert Scope(1).parent is Scope.root
+
+def test_remove():
+    scope = Scope(Scope(Scope(1), '<'), '(')
+    assert scope.remove('<') is Scope(Scope(1), '(')
+    assert scope.last == '('
+
+def test_state_remove():
+    state = ScopeState(ScopeState(), '<')
+    inner = ScopeState(state, '(')
+    assert inner.scope is Scope(Scope(Scope(None), '<'), '(')
+    state.remove('<')
+    assert inner.scope is Scope(Scope(None), '(')
+    assert inner.scope.is_global()